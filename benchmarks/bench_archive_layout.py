@@ -0,0 +1,156 @@
+"""
+Benchmark of the tile archive chunk layouts and compressors on a local store.
+
+Creates the archive of a tile with create_zarr_patch_structure for every layout and
+compressor, writes a synthetic time series one (timestamp, band) patch at a time as
+the extraction workers do, and measures:
+
+- write throughput, in MB/s of uncompressed patches
+- compressed size of the data array, and the compression ratio
+- read latency of the full time series of all bands of a random pixel block
+
+    python benchmarks/bench_archive_layout.py --n-timestamps 32 --patch-size 2000
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import fsspec
+import numpy as np
+import zarr
+from satextractor.models import BAND_INFO
+from satextractor.preparer import create_zarr_patch_structure
+
+CONSTELLATION = "sentinel-2"
+
+# (name, band_chunk, spatial chunks per patch side), chunks hold a single timestamp
+LAYOUTS = [
+    ("patch", 1, None),
+    ("patch/4", 1, 4),
+    ("band-blocked", 13, 4),
+]
+
+COMPRESSORS = {
+    "default": None,
+    "lz4-bitshuffle": {"id": "blosc", "cname": "lz4", "clevel": 5, "shuffle": 2},
+    "zstd1-shuffle": {"id": "blosc", "cname": "zstd", "clevel": 1, "shuffle": 1},
+    "zstd5-bitshuffle": {"id": "blosc", "cname": "zstd", "clevel": 5, "shuffle": 2},
+}
+
+
+def make_patches(n_timestamps, n_bands, patch_px, seed=0):
+    # smooth fields with noise, and some fully empty revisits
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:patch_px, 0:patch_px]
+    base = 1000 + 500 * np.sin(xx / 40) * np.cos(yy / 60)
+    for t in range(n_timestamps):
+        empty = rng.random() < 0.2
+        for b in range(n_bands):
+            if empty:
+                yield t, b, np.zeros((patch_px, patch_px), dtype=np.uint16)
+            else:
+                patch = base * (1 + 0.1 * b) + rng.normal(0, 30, base.shape)
+                yield t, b, patch.astype(np.uint16)
+
+
+def dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def bench_layout(root, tile_id, args, band_chunk, chunk_size, compressor):
+    fs = fsspec.filesystem("file")
+    bands = BAND_INFO[CONSTELLATION]
+    patch_px = args.patch_size // 10
+    sensing_times = np.array(
+        [
+            np.datetime64(datetime.datetime(2020, 1, 1) + datetime.timedelta(days=5 * i))
+            for i in range(args.n_timestamps)
+        ],
+    )
+
+    create_zarr_patch_structure(
+        fs.get_mapper,
+        root,
+        tile_id,
+        args.patch_size,
+        chunk_size,
+        sensing_times,
+        CONSTELLATION,
+        bands,
+        True,
+        band_chunk,
+        compressor,
+    )
+    data_path = f"{root}/{tile_id}/{CONSTELLATION}/data"
+    arr = zarr.open_array(fs.get_mapper(data_path), "r+")
+
+    tic = time.perf_counter()
+    for t, b, patch in make_patches(args.n_timestamps, len(bands), patch_px):
+        arr[t, b, :, :] = patch
+    t_write = time.perf_counter() - tic
+    raw_bytes = args.n_timestamps * len(bands) * patch_px ** 2 * 2
+
+    rng = np.random.default_rng(1)
+    block = args.read_block
+    latencies = []
+    for _ in range(args.n_reads):
+        y, x = rng.integers(0, patch_px - block, 2)
+        tic = time.perf_counter()
+        arr[:, :, y : y + block, x : x + block]
+        latencies.append(time.perf_counter() - tic)
+
+    return {
+        "write_mb_s": raw_bytes / t_write / 1024 ** 2,
+        "size_mb": dir_size(data_path) / 1024 ** 2,
+        "ratio": raw_bytes / dir_size(data_path),
+        "read_ms": np.median(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-timestamps", type=int, default=32)
+    parser.add_argument("--patch-size", type=int, default=2000, help="tile size in m")
+    parser.add_argument("--read-block", type=int, default=16, help="read block in px")
+    parser.add_argument("--n-reads", type=int, default=20)
+    parser.add_argument("--compressors", nargs="+", default=list(COMPRESSORS))
+    args = parser.parse_args()
+
+    patch_px = args.patch_size // 10
+    print(
+        f"{args.n_timestamps} timestamps of {patch_px}x{patch_px}px patches, "
+        f"reading the time series of {args.read_block}x{args.read_block}px blocks",
+    )
+    print(
+        f"{'layout':18s} {'chunks':>20s} {'compressor':18s} "
+        f"{'write MB/s':>10s} {'size MB':>8s} {'ratio':>6s} {'read ms':>8s}",
+    )
+
+    with tempfile.TemporaryDirectory() as root:
+        for name, band_chunk, chunk_div in LAYOUTS:
+            chunk_size = patch_px // chunk_div if chunk_div else patch_px
+            chunks = f"(1,{band_chunk},{chunk_size},{chunk_size})"
+            for compressor_name in args.compressors:
+                result = bench_layout(
+                    root,
+                    f"{name.replace('/', '_')}_{compressor_name}",
+                    args,
+                    band_chunk,
+                    chunk_size,
+                    COMPRESSORS[compressor_name],
+                )
+                print(
+                    f"{name:18s} {chunks:>20s} {compressor_name:18s} "
+                    f"{result['write_mb_s']:10.1f} {result['size_mb']:8.1f} "
+                    f"{result['ratio']:6.2f} {result['read_ms']:8.2f}",
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Scaling benchmark of the clustering of the tiles in UTM splits by the scheduler.
+
+Compares the original clustering (splitting the tiles multipolygon in UTM squares,
+and checking every split against every tile) against
+scheduler.cluster_tiles_in_utm, for a growing number of tiles in two UTM zones.
+The loop is only run up to --max-loop-tiles, and both must give the same clusters.
+
+    python benchmarks/bench_cluster_tiles.py --n-tiles 1000 10000 100000 1000000
+"""
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from satextractor.models import Tile
+from satextractor.scheduler.scheduler import cluster_tiles_in_utm
+from satextractor.tiler import split_region_in_utm_tiles
+from sentinelhub import CRS
+
+
+def loop_cluster_tiles_in_utm(tiles, split_m):
+    tiles_geom = gpd.GeoSeries([shapely.geometry.box(*t.bbox_wgs84) for t in tiles])
+
+    tiles_geom_multi = shapely.geometry.MultiPolygon(list(tiles_geom.values))
+    splits = split_region_in_utm_tiles(
+        tiles_geom_multi,
+        crs=CRS.WGS84,
+        bbox_size=split_m,
+    )
+
+    tiles_gdf = gpd.GeoDataFrame({"geometry": tiles_geom})
+    for cluster_i, s in enumerate(splits):
+        contained_tile_indexes = [i for i in range(len(tiles)) if s.contains(tiles[i])]
+        tiles_gdf.loc[contained_tile_indexes, "cluster_id"] = cluster_i
+
+    return tiles_gdf
+
+
+def make_tiles(n_tiles, tile_size=1000, max_width=360):
+    # half of the tiles in the UTM zone 30 and half in 31, in a strip around the
+    # central meridian narrow enough to stay in the zone up to 1M tiles
+    tiles = []
+    for zone, n_zone in [(30, n_tiles // 2), (31, n_tiles - n_tiles // 2)]:
+        width = min(int(np.ceil(np.sqrt(n_zone))), max_width)
+        min_x = 500000 - width // 2 * tile_size
+        for i in range(n_zone):
+            x = min_x + (i % width) * tile_size
+            y = 4400000 + (i // width) * tile_size
+            tiles.append(
+                Tile(zone, "T", x, y, x + tile_size, y + tile_size, 32600 + zone),
+            )
+    return tiles
+
+
+def same_clusters(a, b):
+    # the clusters are the same partition of the tiles, whatever their ids
+    pairs = np.unique(np.stack([a, b], axis=1), axis=0)
+    return len(pairs) == len(np.unique(a)) == len(np.unique(b))
+
+
+def timeit(f, *args):
+    tic = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - tic, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-tiles", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--split-m", type=int, default=100000)
+    parser.add_argument("--max-loop-tiles", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'tiles':>9s} {'clusters':>9s} {'loop s':>9s} {'vectorized s':>13s}")
+    for n_tiles in args.n_tiles:
+        tiles = make_tiles(n_tiles)
+        t_vec, clusters = timeit(cluster_tiles_in_utm, tiles, args.split_m)
+        n_clusters = clusters.cluster_id.nunique()
+
+        if n_tiles <= args.max_loop_tiles:
+            t_loop, loop_clusters = timeit(
+                loop_cluster_tiles_in_utm,
+                tiles,
+                args.split_m,
+            )
+            assert same_clusters(
+                clusters.cluster_id.values,
+                loop_clusters.cluster_id.values,
+            ), "the clusters differ"
+            loop = f"{t_loop:9.2f}"
+        else:
+            loop = f"{'-':>9s}"
+
+        print(f"{n_tiles:9d} {n_clusters:9d} {loop} {t_vec:13.2f}")
+
+
+if __name__ == "__main__":
+    main()
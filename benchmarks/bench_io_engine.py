@@ -0,0 +1,127 @@
+"""
+Benchmark of the extractor io engines on local JP2 and GeoTIFF fixtures.
+
+Reads the same windows of a synthetic band through a python file object from fsspec
+("fsspec" engine, as the worker does with gcsfs) and through GDAL's own file access
+("vsi" engine), with one and all the cpus for decoding. Local files only measure the
+decoding and the file object overhead, not the network requests.
+
+    python benchmarks/bench_io_engine.py --size 5490 --n-windows 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import fsspec
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from satextractor.extractor import configure_dataset_cache
+from satextractor.extractor import configure_io_engine
+from satextractor.extractor.extractor import read_asset_window
+from satextractor.models import Tile
+
+LEFT, TOP, RES = 399960, 4500000, 20
+
+FIXTURES = {
+    "jp2": dict(driver="JP2OpenJPEG", QUALITY="100", REVERSIBLE="YES", BLOCKXSIZE=1024),
+    "tif": dict(
+        driver="GTiff",
+        tiled=True,
+        blockxsize=512,
+        blockysize=512,
+        compress="deflate",
+    ),
+}
+
+
+def make_fixture(path, size, driver, **kwargs):
+    # smooth data with some noise compresses like a real band
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:size, 0:size]
+    arr = 1000 + 500 * np.sin(xx / 200) * np.cos(yy / 300)
+    arr += rng.normal(0, 50, (size, size))
+
+    with rasterio.open(
+        path,
+        "w",
+        driver=driver,
+        width=size,
+        height=size,
+        count=1,
+        dtype="uint16",
+        crs=CRS.from_epsg(32630),
+        transform=Affine(RES, 0, LEFT, 0, -RES, TOP),
+        **kwargs,
+    ) as dst:
+        dst.write(arr.astype(np.uint16), 1)
+
+
+def make_windows(size, n_windows, window_px):
+    # windows of a single tile, spread over the raster
+    rng = np.random.default_rng(1)
+    windows = []
+    for _ in range(n_windows):
+        col, row = rng.integers(0, size - window_px, 2)
+        min_x = LEFT + col * RES
+        max_y = TOP - row * RES
+        tile = Tile(
+            30,
+            "T",
+            min_x,
+            max_y - window_px * RES,
+            min_x + window_px * RES,
+            max_y,
+            32630,
+        )
+        windows.append([tile])
+    return windows
+
+
+def time_reads(fs, path, windows, window_px, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        for tiles in windows:
+            read_asset_window(
+                fs,
+                path,
+                tiles,
+                (window_px, window_px),
+                Resampling.bilinear,
+            )
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=5490)
+    parser.add_argument("--n-windows", type=int, default=8)
+    parser.add_argument("--window", type=int, default=1000, help="window side in pixels")
+    parser.add_argument("--formats", nargs="+", default=list(FIXTURES))
+    args = parser.parse_args()
+
+    fs = fsspec.filesystem("file")
+    windows = make_windows(args.size, args.n_windows, args.window)
+    # open the file for every read, as a worker does for new assets
+    configure_dataset_cache(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for fmt in args.formats:
+            path = os.path.join(tmpdir, f"band.{fmt}")
+            make_fixture(path, args.size, **FIXTURES[fmt])
+
+            print(f"{fmt}, {args.size}px raster, {args.n_windows} windows of {args.window}px")
+            for engine in ["fsspec", "vsi"]:
+                for num_threads in ["1", "ALL_CPUS"]:
+                    configure_io_engine(engine, num_threads=num_threads)
+                    t = time_reads(fs, path, windows, args.window)
+                    print(f"  {engine:6s} threads={num_threads:8s} {t * 1000:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
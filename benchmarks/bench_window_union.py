@@ -0,0 +1,89 @@
+"""
+Microbenchmark of the window union computed for every asset of every task.
+
+Compares the per-tile loop (one transform_bounds and from_bounds per tile)
+against extractor.get_window_union, for rasters in the tiles CRS and in a
+neighbouring UTM zone.
+
+    python benchmarks/bench_window_union.py --n-tiles 10000
+"""
+import argparse
+import time
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio import warp
+from rasterio.crs import CRS
+from rasterio.io import MemoryFile
+from satextractor.extractor.extractor import get_window_union
+from satextractor.models import Tile
+
+
+def loop_window_union(tiles, ds):
+    windows = []
+    for tile in tiles:
+        bounds_arr_rast_crs = warp.transform_bounds(
+            CRS.from_epsg(tile.epsg),
+            ds.crs,
+            *tile.bbox,
+        )
+        windows.append(rasterio.windows.from_bounds(*bounds_arr_rast_crs, ds.transform))
+    return rasterio.windows.union(windows)
+
+
+def make_tiles(n_tiles, tile_size=1000, epsg=32630):
+    side = int(np.ceil(np.sqrt(n_tiles)))
+    return [
+        Tile(
+            zone=30,
+            row="U",
+            min_x=400000 + (i % side) * tile_size,
+            min_y=4400000 + (i // side) * tile_size,
+            max_x=400000 + (i % side + 1) * tile_size,
+            max_y=4400000 + (i // side + 1) * tile_size,
+            epsg=epsg,
+        )
+        for i in range(n_tiles)
+    ]
+
+
+def timeit(f, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = f(*args)
+        best = min(best, time.perf_counter() - tic)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-tiles", type=int, default=10000)
+    args = parser.parse_args()
+
+    tiles = make_tiles(args.n_tiles)
+
+    for epsg in [32630, 32629]:
+        profile = dict(
+            driver="GTiff",
+            width=10980,
+            height=10980,
+            count=1,
+            dtype="uint16",
+            crs=CRS.from_epsg(epsg),
+            transform=Affine(10, 0, 399960, 0, -10, 4500000),
+        )
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as ds:
+                t_loop, w_loop = timeit(loop_window_union, tiles, ds, repeat=1)
+                t_vec, w_vec = timeit(get_window_union, tiles, ds)
+
+        print(f"EPSG:{epsg}, {len(tiles)} tiles")
+        print(f"  loop:       {t_loop * 1000:10.2f} ms  {w_loop}")
+        print(f"  vectorized: {t_vec * 1000:10.2f} ms  {w_vec}")
+        print(f"  speedup:    {t_loop / t_vec:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 import base64
-import datetime
 import json
 import logging
 import os
@@ -7,21 +6,66 @@ import sys
 import time
 import traceback
 
-import cattr
+import attr
 import gcsfs
-import pystac
 from flask import Flask
 from flask import request
 from loguru import logger
+from satextractor.extractor import configure_block_cache
+from satextractor.extractor import configure_dataset_cache
+from satextractor.extractor import configure_io_engine
+from satextractor.extractor import task_mosaic_multiband_patches
+from satextractor.extractor import task_mosaic_patch_blocks
 from satextractor.extractor import task_mosaic_patches
 from satextractor.models import BAND_INFO
-from satextractor.models import ExtractionTask
-from satextractor.models import Tile
+from satextractor.models import deserialize_task
+from satextractor.models import MultiBandExtractionTask
 from satextractor.monitor import GCPMonitor
 from satextractor.storer import store_patches
 
 app = Flask(__name__)
 
+# worker settings, set as environment variables of the cloud run service
+IN_MEMORY = os.environ.get("EXTRACTOR_IN_MEMORY", "true").lower() == "true"
+FETCH_WORKERS = int(os.environ.get("EXTRACTOR_FETCH_WORKERS", 4))
+MOSAIC_METHOD = os.environ.get("EXTRACTOR_MOSAIC_METHOD", "max")
+NATIVE_RESOLUTION = (
+    os.environ.get("EXTRACTOR_NATIVE_RESOLUTION", "false").lower() == "true"
+)
+# read the tiles overlapped by a single asset without mosaicking the task extent
+DIRECT_READS = os.environ.get("EXTRACTOR_DIRECT_READS", "true").lower() == "true"
+STORE_WORKERS = int(os.environ.get("EXTRACTOR_STORE_WORKERS", 16))
+# threads compressing the archive chunks, 0 for one per cpu of the container
+ENCODE_WORKERS = int(os.environ.get("EXTRACTOR_ENCODE_WORKERS", 0))
+# extract large tasks in spatial blocks to bound the memory, 0 to extract them at once.
+# The budget includes the whole assets held by the fsspec io engine and the dataset cache
+MEMORY_BUDGET = int(os.environ.get("EXTRACTOR_MEMORY_BUDGET_MB", 0)) * 1024 ** 2
+
+# "fsspec" reads the assets through gcsfs, "vsi" lets GDAL read them through /vsigs/
+# with the service account credentials from the metadata server
+IO_ENGINE = os.environ.get("EXTRACTOR_IO_ENGINE", "fsspec")
+configure_io_engine(
+    engine=IO_ENGINE,
+    num_threads=os.environ.get("EXTRACTOR_GDAL_NUM_THREADS", "ALL_CPUS"),
+    cache_max_mb=int(os.environ.get("EXTRACTOR_GDAL_CACHEMAX_MB", 256)),
+    vsi_cache_mb=int(os.environ.get("EXTRACTOR_VSI_CACHE_MB", 64)),
+    chunk_size_kb=int(os.environ.get("EXTRACTOR_VSI_CHUNK_KB", 1024)),
+)
+
+# the block cache keeps whole assets, to avoid downloading them again for neighbouring
+# tasks. On cloud run the local disk is in memory, size the block cache accordingly
+block_cache = configure_block_cache(
+    cache_dir=os.environ.get("EXTRACTOR_BLOCK_CACHE_DIR"),
+    max_bytes=int(os.environ.get("EXTRACTOR_BLOCK_CACHE_MB", 1024)) * 1024 ** 2,
+    block_size=int(os.environ.get("EXTRACTOR_BLOCK_CACHE_BLOCK_KB", 2048)) * 1024,
+)
+if block_cache is not None and IO_ENGINE == "vsi":
+    logger.warning("The block cache is not used by the vsi io engine.")
+dataset_cache = configure_dataset_cache(
+    maxsize=int(os.environ.get("EXTRACTOR_DATASET_CACHE_SIZE", 8)),
+    ttl=float(os.environ.get("EXTRACTOR_DATASET_CACHE_TTL", 300)),
+)
+
 
 if __name__ != "__main__":
     # Redirect Flask logs to Gunicorn logs
@@ -40,6 +84,16 @@ def format_stacktrace():
     return "".join(parts)
 
 
+def read_items(fs, items_path, item_ids):
+    # the items of a compact task, read concurrently from the items table
+    paths = {
+        item_id: fs._strip_protocol(f"{items_path}/{item_id}.json")
+        for item_id in item_ids
+    }
+    contents = fs.cat(list(paths.values()))
+    return {item_id: json.loads(contents[path]) for item_id, path in paths.items()}
+
+
 @app.route("/", methods=["POST"])
 def extract_patches():
 
@@ -69,24 +123,22 @@ def extract_patches():
 
         fs = gcsfs.GCSFileSystem()
 
-        # ExtractionTask data
+        # ExtractionTask data, compact tasks reference the items by id
         extraction_task = request_json["extraction_task"]
-        tiles = [cattr.structure(t, Tile) for t in extraction_task["tiles"]]
-        item_collection = pystac.ItemCollection.from_dict(
-            extraction_task["item_collection"],
-        )
-        band = extraction_task["band"]
-        task_id = extraction_task["task_id"]
-        constellation = extraction_task["constellation"]
-        sensing_time = datetime.datetime.fromisoformat(extraction_task["sensing_time"])
-        task = ExtractionTask(
-            task_id,
-            tiles,
-            item_collection,
-            band,
-            constellation,
-            sensing_time,
-        )
+        items = None
+        if "items_path" in request_json:
+            items = read_items(
+                fs,
+                request_json["items_path"],
+                extraction_task["item_ids"],
+            )
+        task = deserialize_task(extraction_task, items)
+        task_id = task.task_id
+        constellation = task.constellation
+        if isinstance(task, MultiBandExtractionTask):
+            mosaic_patches = task_mosaic_multiband_patches
+        else:
+            mosaic_patches = task_mosaic_patches
 
         logger.info(f"Ready to extract {len(task.tiles)} tiles.")
 
@@ -112,22 +164,49 @@ def extract_patches():
             min([b["gsd"] for _, b in BAND_INFO[constellation].items()]),
         )
 
-        patches = task_mosaic_patches(
-            cloud_fs=fs,
-            task=task,
-            method="max",
-            resolution=archive_resolution,
-        )
+        if MEMORY_BUDGET > 0:
+            blocks = task_mosaic_patch_blocks(
+                cloud_fs=fs,
+                task=task,
+                memory_budget=MEMORY_BUDGET,
+                method=MOSAIC_METHOD,
+                resolution=archive_resolution,
+                max_workers=FETCH_WORKERS,
+                native_resolution=NATIVE_RESOLUTION,
+                direct_reads=DIRECT_READS,
+            )
+        else:
+            patches = mosaic_patches(
+                cloud_fs=fs,
+                task=task,
+                method=MOSAIC_METHOD,
+                resolution=archive_resolution,
+                in_memory=IN_MEMORY,
+                max_workers=FETCH_WORKERS,
+                native_resolution=NATIVE_RESOLUTION,
+                direct_reads=DIRECT_READS,
+            )
+            blocks = [(task.tiles, patches)]
+
+        n_patches = 0
+        for block_tiles, patches in blocks:
+            logger.info(f"Ready to store {len(patches)} patches at {storage_gs_path}.")
+            store_patches(
+                fs.get_mapper,
+                storage_gs_path,
+                patches,
+                attr.evolve(task, tiles=block_tiles),
+                bands,
+                archive_resolution,
+                max_workers=STORE_WORKERS,
+                encode_workers=ENCODE_WORKERS or None,
+            )
+            n_patches += len(patches)
 
-        logger.info(f"Ready to store {len(patches)} patches at {storage_gs_path}.")
-        store_patches(
-            fs.get_mapper,
-            storage_gs_path,
-            patches,
-            task,
-            bands,
-            archive_resolution,
-        )
+        if dataset_cache is not None:
+            logger.info(f"Dataset cache stats: {dataset_cache.stats()}")
+        if block_cache is not None:
+            logger.info(f"Block cache stats: {block_cache.stats()}")
 
         toc = time.time()
 
@@ -138,10 +217,10 @@ def extract_patches():
             )
 
         logger.info(
-            f"{len(patches)} patches were succesfully stored in {storage_gs_path}.",
+            f"{n_patches} patches were succesfully stored in {storage_gs_path}.",
         )
 
-        return f"Extracted {len(patches)} patches.", 200
+        return f"Extracted {n_patches} patches.", 200
 
     except Exception as e:
 
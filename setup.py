@@ -80,8 +80,9 @@ setup(
         "gunicorn~=20.1.0",
         "pyproj~=3.2.1",
         "geopandas~=0.10.2",
+        "rtree~=0.9.7",  # spatial index of the geopandas joins of the scheduler
         "rasterio~=1.2.10",
-        "zarr~=2.10.2",
+        "zarr==2.10.3",  # the storer encodes chunks with private zarr methods
         "tqdm~=4.62.3",
         "google-api-python-client>=2.29.0",
         "google-cloud-storage>=1.42.3",
@@ -0,0 +1,284 @@
+"""
+Helpers to read and write the zarr archives layout shared by the preparer, the
+scheduler and the storer.
+
+Each tile and constellation archive is a zarr group with a `data` array and a
+`timestamps` array with the sensing time of each of its rows. Format version 1
+archives store the timestamps as "<U27" iso format strings, version 2 archives as
+datetime64[ns]. Both keep the rows sorted by sensing time.
+
+Since version 3 the rows are append only: new sensing times always get new rows at
+the end, even if they are older than existing ones, so the existing data chunks are
+never rewritten. The `order` array holds the rows in time order, i.e.
+timestamps[order] is sorted. The version is kept in the `format_version` attribute
+of the group.
+
+All nodata chunks of `data` are not written, so the patches with data are the ones
+with stored chunks: read_coverage lists the chunks of the `data` array to get the
+(timestamps, bands) coverage of an archive. It isn't stored in its own array, as
+the concurrent extraction tasks of a timestamp would all rewrite the same chunk.
+Archives prepared in bulk have their metadata consolidated in the tile group, so
+they can be opened with a single request.
+"""
+
+import datetime
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Union
+
+import numcodecs
+import numpy as np
+import zarr
+from loguru import logger
+from zarr.errors import ArrayNotFoundError
+from zarr.errors import PathNotFoundError
+
+ARCHIVE_FORMAT_VERSION = 3
+TIMESTAMPS_DTYPE = "datetime64[ns]"
+ORDER_DTYPE = "int64"
+
+
+def get_compressor(compressor: Optional[Dict[str, Any]] = None) -> Any:
+    """Get the numcodecs compressor of the data arrays from its config.
+
+    Args:
+        compressor (Optional[Dict[str, Any]], optional): a numcodecs codec config, e.g.
+            {"id": "blosc", "cname": "zstd", "clevel": 5, "shuffle": 2}.
+            Defaults to the zarr default compressor.
+
+    Returns:
+        Any: the numcodecs codec
+    """
+    if compressor is None:
+        return zarr.storage.default_compressor
+    return numcodecs.get_codec(dict(compressor))
+
+
+def open_archive(fs_mapper: Any, tile_path: str) -> zarr.hierarchy.Group:
+    """Open the archive group of a tile read only, with its consolidated metadata
+    if available.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        tile_path (str): the path of the tile group
+
+    Returns:
+        zarr.hierarchy.Group: the tile group
+    """
+    store = fs_mapper(tile_path)
+    try:
+        return zarr.open_consolidated(store, mode="r")
+    except KeyError:
+        return zarr.open_group(store, mode="r")
+
+
+def update_consolidated_metadata(fs_mapper: Any, tile_path: str, consolidated: bool):
+    """Update the consolidated metadata of a tile archive after its structure changed.
+    Stale consolidated metadata would hide the changes to its readers, so it is
+    removed when the archive is not consolidated anymore.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        tile_path (str): the path of the tile group
+        consolidated (bool): consolidate the metadata, or remove it
+    """
+    store = fs_mapper(tile_path)
+    if consolidated:
+        zarr.consolidate_metadata(store)
+    elif ".zmetadata" in store:
+        del store[".zmetadata"]
+
+
+def get_format_version(fs_mapper: Any, patch_constellation_path: str) -> int:
+    """Get the format version of an archive, 1 for archives without one.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        patch_constellation_path (str): the path of the tile constellation group
+
+    Returns:
+        int: the archive format version
+    """
+    group = zarr.open_group(fs_mapper(patch_constellation_path), "r")
+    return group.attrs.get("format_version", 1)
+
+
+def set_format_version(
+    fs_mapper: Any,
+    patch_constellation_path: str,
+    format_version: int = ARCHIVE_FORMAT_VERSION,
+):
+    group = zarr.open_group(fs_mapper(patch_constellation_path), "a")
+    group.attrs["format_version"] = format_version
+
+
+def read_timestamps(fs_mapper: Any, timestamps_path: str) -> np.ndarray:
+    """Read the timestamps of an archive of any format version.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        timestamps_path (str): the path of the timestamps array
+
+    Returns:
+        np.ndarray: the timestamps as datetime64[ns]
+    """
+    timestamps = zarr.open_array(fs_mapper(timestamps_path), "r")[:]
+    # string timestamps are parsed by numpy in a single vectorized cast
+    return timestamps.astype(TIMESTAMPS_DTYPE)
+
+
+def write_timestamps(
+    fs_mapper: Any,
+    timestamps_path: str,
+    timestamps: np.ndarray,
+) -> zarr.Array:
+    """Write the timestamps of an archive as datetime64[ns], replacing existing ones.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        timestamps_path (str): the path of the timestamps array
+        timestamps (np.ndarray): the timestamps of the rows
+
+    Returns:
+        zarr.Array: the timestamps array
+    """
+    z_dates = zarr.open_array(
+        fs_mapper(timestamps_path),
+        mode="w",
+        shape=(len(timestamps)),
+        chunks=(len(timestamps)),
+        dtype=TIMESTAMPS_DTYPE,
+    )
+    z_dates[:] = np.asarray(timestamps).astype(TIMESTAMPS_DTYPE)
+    return z_dates
+
+
+def write_order(fs_mapper: Any, order_path: str, timestamps: np.ndarray) -> zarr.Array:
+    """Write the time order of the rows of an archive, replacing the existing one.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        order_path (str): the path of the order array
+        timestamps (np.ndarray): the timestamps of the rows
+
+    Returns:
+        zarr.Array: the order array
+    """
+    order = np.argsort(np.asarray(timestamps).astype(TIMESTAMPS_DTYPE), kind="stable")
+    z_order = zarr.open_array(
+        fs_mapper(order_path),
+        mode="w",
+        shape=(len(order)),
+        chunks=(len(order)),
+        dtype=ORDER_DTYPE,
+    )
+    z_order[:] = order
+    return z_order
+
+
+def read_order(fs_mapper: Any, order_path: str) -> Optional[np.ndarray]:
+    """Read the time order of the rows of an archive.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        order_path (str): the path of the order array
+
+    Returns:
+        Optional[np.ndarray]: the rows in time order, None for archives older than
+            format version 3, whose rows are sorted
+    """
+    try:
+        return zarr.open_array(fs_mapper(order_path), "r")[:]
+    except (ArrayNotFoundError, PathNotFoundError):
+        return None
+
+
+def get_timestamp_index(
+    timestamps: np.ndarray,
+    sensing_time: Union[datetime.datetime, np.datetime64],
+    order: Optional[np.ndarray] = None,
+) -> int:
+    """Get the row of a sensing time in the timestamps of an archive.
+
+    Args:
+        timestamps (np.ndarray): the archive timestamps, as datetime64
+        sensing_time (Union[datetime.datetime, np.datetime64]): the sensing time to look for
+        order (Optional[np.ndarray], optional): the rows in time order. Defaults to None,
+            for sorted timestamps.
+
+    Returns:
+        int: the row of the sensing time
+    """
+    sensing_time = np.datetime64(sensing_time, "ns")
+    sorted_timestamps = timestamps if order is None else timestamps[order]
+    idx = int(np.searchsorted(sorted_timestamps, sensing_time))
+    if idx == len(timestamps) or sorted_timestamps[idx] != sensing_time:
+        raise ValueError(f"{sensing_time} is not in the archive timestamps")
+    return idx if order is None else int(order[idx])
+
+
+def read_coverage(archive: zarr.hierarchy.Group, constellation: str) -> np.ndarray:
+    """Get the coverage of an archive, i.e. which bands of which rows have data, from
+    the chunks stored in its `data` array. A band chunk with any data marks all its
+    bands as covered. The rows are in the archive order, see `order`.
+
+    Args:
+        archive (zarr.hierarchy.Group): the tile group, see open_archive
+        constellation (str): the constellation
+
+    Returns:
+        np.ndarray: the (timestamps, bands) boolean coverage
+    """
+    data = archive[f"{constellation}/data"]
+    n_timestamps, n_bands = data.shape[:2]
+    band_chunk = data.chunks[1]
+
+    coverage = np.zeros((n_timestamps, n_bands), dtype=bool)
+    # the chunk keys are "<row>.<band chunk>.<y>.<x>", the metadata keys start with "."
+    for key in zarr.storage.listdir(data.chunk_store, data.path):
+        if key.startswith("."):
+            continue
+        timestamp_idx, band_chunk_idx = (int(idx) for idx in key.split(".")[:2])
+        if timestamp_idx < n_timestamps:
+            start = band_chunk_idx * band_chunk
+            coverage[timestamp_idx, start : start + band_chunk] = True
+
+    return coverage
+
+
+def migrate_archive_timestamps(
+    fs_mapper: Any,
+    storage_path: str,
+    tile_id: str,
+    constellation: str,
+) -> bool:
+    """Migrate an archive to the current format version: the timestamps of format
+    version 1 archives are converted to datetime64[ns], and the order of the rows,
+    which are sorted before version 3, is added. The data arrays are not modified.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        storage_path (str): the archive root path
+        tile_id (str): the tile id
+        constellation (str): the constellation
+
+    Returns:
+        bool: True if the archive was migrated, False if it was already up to date
+    """
+    patch_constellation_path = f"{storage_path}/{tile_id}/{constellation}"
+    timestamps_path = f"{patch_constellation_path}/timestamps"
+    order_path = f"{patch_constellation_path}/order"
+
+    format_version = get_format_version(fs_mapper, patch_constellation_path)
+    if format_version >= ARCHIVE_FORMAT_VERSION:
+        return False
+
+    timestamps = read_timestamps(fs_mapper, timestamps_path)
+    if format_version < 2:
+        write_timestamps(fs_mapper, timestamps_path, timestamps)
+    write_order(fs_mapper, order_path, timestamps)
+    set_format_version(fs_mapper, patch_constellation_path)
+    logger.debug(f"Migrated {timestamps_path} to format version {ARCHIVE_FORMAT_VERSION}")
+
+    return True
@@ -19,11 +19,57 @@ import datetime
 import hashlib
 import os
 import pickle
+from typing import Iterable
+from typing import Iterator
 
 import geopandas as gpd
 import hydra
 from loguru import logger
 from omegaconf import DictConfig
+from satextractor.models import TileSet
+
+
+def dump_tasks(tasks: Iterable, path: str) -> int:
+    """Pickle the tasks one by one as they come, so a stream of tasks is never all in
+    memory. The file is moved into place once complete, an interrupted run leaves no
+    tasks file behind.
+
+    Args:
+        tasks (Iterable): the extraction tasks
+        path (str): the tasks file path
+
+    Returns:
+        int: the number of tasks
+    """
+    n_tasks = 0
+    with open(f"{path}.tmp", "wb") as f:
+        for task in tasks:
+            pickle.dump(task, f)
+            n_tasks += 1
+    os.replace(f"{path}.tmp", path)
+    return n_tasks
+
+
+def load_tasks(path: str) -> Iterator:
+    """Read the tasks of a tasks file one by one. Files of older versions, pickling the
+    whole list of tasks at once, are read as well.
+
+    Args:
+        path (str): the tasks file path
+
+    Yields:
+        Iterator: the extraction tasks
+    """
+    with open(path, "rb") as f:
+        while True:
+            try:
+                task = pickle.load(f)
+            except EOFError:
+                return
+            if isinstance(task, list):
+                yield from task
+            else:
+                yield task
 
 
 def build(cfg):
@@ -80,6 +126,8 @@ def tiler(cfg):
 
     logger.info(f"Generated tile patches: {len(tiles)}")
 
+    # the tiles are stored by columns, the next tasks iterate them as Tile objects
+    tiles = TileSet.from_tiles(tiles)
     with open(cfg.tiles, "wb") as f:
         pickle.dump(tiles, f)
 
@@ -112,17 +160,40 @@ def scheduler(cfg):
         **cfg.scheduler,
     )
 
-    logger.info(f"Generated Extraction Tasks: {len(extraction_tasks)}")
+    n_tasks = dump_tasks(extraction_tasks, cfg.extraction_tasks)
+
+    logger.info(f"Generated Extraction Tasks: {n_tasks}")
+
+
+def planner(cfg):
 
-    with open(cfg.extraction_tasks, "wb") as f:
-        pickle.dump(extraction_tasks, f)
+    logger.info(f"using {cfg.planner._target_} to plan the extraction")
+
+    extraction_tasks = list(load_tasks(cfg.extraction_tasks))
+    tiles = pickle.load(open(cfg.tiles, "rb"))
+
+    plan = hydra.utils.call(
+        cfg.planner,
+        tiles,
+        extraction_tasks,
+        cfg.constellations,
+        cfg.tiler.bbox_size,
+        cfg.preparer.chunk_size,
+        band_chunk=cfg.preparer.get("band_chunk", 1),
+        compressor=cfg.preparer.get("compressor"),
+        consolidated=cfg.preparer.get("consolidated", False),
+        compact=cfg.deployer.get("compact", False),
+    )
+
+    logger.info(f"Extraction plan:\n{plan.round(1).to_string()}")
+    plan.to_csv(cfg.plan)
 
 
 def preparer(cfg):
 
     logger.info(f"using {cfg.preparer._target_} to prepare zarr archives")
 
-    extraction_tasks = pickle.load(open(cfg.extraction_tasks, "rb"))
+    extraction_tasks = list(load_tasks(cfg.extraction_tasks))
     tiles = pickle.load(open(cfg.tiles, "rb"))
 
     hydra.utils.call(
@@ -137,10 +208,26 @@ def preparer(cfg):
     )
 
 
+def migrator(cfg):
+
+    logger.info(f"using {cfg.migrator._target_} to migrate zarr archives")
+
+    tiles = pickle.load(open(cfg.tiles, "rb"))
+
+    hydra.utils.call(
+        cfg.migrator,
+        cfg.credentials,
+        tiles,
+        cfg.constellations,
+        f"{cfg.cloud.storage_prefix}/{cfg.cloud.storage_root}/{cfg.dataset_name}",
+    )
+
+
 def deployer(cfg):
     logger.info(f"using {cfg.deployer._target_} deployer")
 
-    extraction_tasks = pickle.load(open(cfg.extraction_tasks, "rb"))
+    # the deployer consumes the tasks as they are read
+    extraction_tasks = load_tasks(cfg.extraction_tasks)
 
     topic = f"projects/{cfg.cloud.project}/topics/{'-'.join([cfg.cloud.user_id, 'stacextractor'])}"
     job_id = (
@@ -162,7 +249,7 @@ def plugins(cfg):
 
     logger.info(f"using {cfg.plugins._target_} as plugin")
 
-    extraction_tasks = pickle.load(open(cfg.extraction_tasks, "rb"))
+    extraction_tasks = list(load_tasks(cfg.extraction_tasks))
 
     hydra.utils.call(
         cfg.plugins,
@@ -190,10 +277,12 @@ def main(cfg: DictConfig):
             "stac",
             "tile",
             "schedule",
+            "plan",
             "prepare",
             "deploy",
             "plugins",
-        ], "valid tasks are [build, stac, tile, schedule, prepare, deploy, plugins]"
+            "migrate",
+        ], "valid tasks are [build, stac, tile, schedule, plan, prepare, deploy, plugins, migrate]"
 
     # prepare a hashed representation of key config values (start time, end time, constellations)
     hash_vals = (
@@ -216,10 +305,15 @@ def main(cfg: DictConfig):
         f"{hash_str}_extraction_tasks.pkl",
     )
 
+    cfg.plan = os.path.join(cfg.output, f"{hash_str}_plan.csv")
+
     pickle.dump(cfg, open(os.path.join(cfg.output, f"{hash_str}_cfg.pkl"), "wb"))
 
     logger.info(f"Running tasks {cfg.tasks} for cfg {hash_str}")
 
+    if "migrate" in cfg.tasks:
+        migrator(cfg)
+
     if "build" in cfg.tasks:
         build(cfg)
 
@@ -232,6 +326,9 @@ def main(cfg: DictConfig):
     if "schedule" in cfg.tasks:
         scheduler(cfg)
 
+    if "plan" in cfg.tasks:
+        planner(cfg)
+
     if "prepare" in cfg.tasks:
         preparer(cfg)
 
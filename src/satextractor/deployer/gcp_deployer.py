@@ -1,13 +1,60 @@
 import concurrent
 import json
 
+from gcsfs import GCSFileSystem
 from google.api_core import retry
 from google.auth import jwt
 from google.cloud import pubsub_v1
 from loguru import logger
+from satextractor.models import serialize_items
 from satextractor.models.constellation_info import BAND_INFO
+from satextractor.preparer.async_engine import put_objects
+from satextractor.scheduler.scheduler import iter_chunks
 from tqdm import tqdm
 
+# the items of the compact tasks are stored once, next to the archives
+ITEMS_DIR = ".items"
+
+
+def upload_items(
+    credentials,
+    extraction_tasks,
+    storage_path,
+    max_in_flight=256,
+    uploaded=None,
+):
+    """Upload the items of the tasks to the items table of the storage path,
+    an object per item, so the workers only read the items of their task.
+
+    Args:
+        credentials (str): path to the service account credentials
+        extraction_tasks (List[ExtractionTask]): the extraction tasks
+        storage_path (str): the archive root path
+        max_in_flight (int, optional): max number of concurrent uploads. Defaults to 256.
+        uploaded (Set[str], optional): the ids of the items already uploaded, skipped
+            and updated with the uploaded ones. Defaults to None.
+
+    Returns:
+        str: the path of the items table
+    """
+    if uploaded is None:
+        uploaded = set()
+
+    items_path = f"{storage_path}/{ITEMS_DIR}"
+    items = serialize_items(extraction_tasks)
+    objects = {
+        f"{items_path}/{item_id}.json": json.dumps(item).encode("utf-8")
+        for item_id, item in items.items()
+        if item_id not in uploaded
+    }
+
+    fs = GCSFileSystem(token=credentials)
+    with tqdm(desc=f"Uploading {len(objects)} items", total=len(objects)) as pbar:
+        put_objects(fs, objects, max_in_flight, pbar=pbar)
+    uploaded.update(items)
+
+    return items_path
+
 
 def deploy_tasks(
     job_id,
@@ -16,9 +63,29 @@ def deploy_tasks(
     storage_path,
     chunk_size,
     topic,
+    compact=True,
+    tasks_chunk=1000,
 ):
+    """Publish a message per extraction task to the topic of the workers.
+    The tasks are consumed in chunks, the items of a chunk are uploaded before its
+    tasks are published, so the tasks can be a stream and are never all in memory.
+
+    Args:
+        job_id (str): the job id
+        credentials (str): path to the service account credentials
+        extraction_tasks (Iterable[ExtractionTask]): the extraction tasks
+        storage_path (str): the archive root path
+        chunk_size (int): the data chunk size
+        topic (str): the topic of the workers
+        compact (bool, optional): send compact tasks, referencing the items uploaded
+            once to the storage path instead of embedding them. Defaults to True.
+        tasks_chunk (int, optional): tasks per chunk. Defaults to 1000.
 
-    logger.info(f"Deploying {len(extraction_tasks)} tasks with job_id: {job_id}")
+    Returns:
+        str: the job id
+    """
+
+    logger.info(f"Deploying tasks with job_id: {job_id}")
 
     credentials_json = json.load(open(credentials, "r"))
 
@@ -32,33 +99,48 @@ def deploy_tasks(
 
     short_retry = retry.Retry(deadline=60)
 
-    publish_futures = []
+    uploaded_items = set()
+    n_tasks = 0
 
-    for _, task in tqdm(enumerate(extraction_tasks)):
-        extraction_task_data = task.serialize()
-        data = dict(
-            storage_gs_path=storage_path,
-            job_id=job_id,
-            extraction_task=extraction_task_data,
-            bands=list(BAND_INFO[task.constellation].keys()),
-            chunks=(1, 1, chunk_size, chunk_size),
-        )
-        data = json.dumps(data, default=str)
+    for tasks in tqdm(iter_chunks(extraction_tasks, tasks_chunk)):
+        if compact:
+            items_path = upload_items(
+                credentials,
+                tasks,
+                storage_path,
+                uploaded=uploaded_items,
+            )
 
-        publish_future = publisher.publish(
-            topic,
-            data.encode("utf-8"),
-            retry=short_retry,
-        )
-        publish_futures.append(publish_future)
+        publish_futures = []
 
-    logger.info(f"Generated {len(publish_futures)} futures.")
+        for task in tasks:
+            extraction_task_data = task.serialize(compact=compact)
+            data = dict(
+                storage_gs_path=storage_path,
+                job_id=job_id,
+                extraction_task=extraction_task_data,
+                bands=list(BAND_INFO[task.constellation].keys()),
+                chunks=(1, 1, chunk_size, chunk_size),
+            )
+            if compact:
+                data["items_path"] = items_path
+            data = json.dumps(data, default=str)
 
-    # Wait for all the publish futures to resolve before exiting.
-    concurrent.futures.wait(
-        publish_futures,
-        return_when=concurrent.futures.ALL_COMPLETED,
-    )
+            publish_future = publisher.publish(
+                topic,
+                data.encode("utf-8"),
+                retry=short_retry,
+            )
+            publish_futures.append(publish_future)
+
+        # Wait for the publish futures of the chunk to resolve before the next one.
+        concurrent.futures.wait(
+            publish_futures,
+            return_when=concurrent.futures.ALL_COMPLETED,
+        )
+        n_tasks += len(tasks)
+
+    logger.info(f"Published {n_tasks} tasks.")
 
     logger.info("Done publishing tasks!")
 
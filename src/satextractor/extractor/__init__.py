@@ -1 +1,7 @@
+from .block_cache import configure_block_cache
+from .cache import configure_dataset_cache
+from .cache import get_dataset_cache
+from .extractor import task_mosaic_multiband_patches
+from .extractor import task_mosaic_patch_blocks
 from .extractor import task_mosaic_patches
+from .io_engine import configure_io_engine
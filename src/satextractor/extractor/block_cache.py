@@ -0,0 +1,329 @@
+import hashlib
+import io
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from loguru import logger
+
+
+class DiskBlockCache:
+    """LRU cache on local disk of the byte ranges fetched from remote files.
+    Files are split in fixed size blocks, each one stored in a file keyed by the
+    href and its byte range. Blocks are evicted once the cache exceeds max_bytes.
+
+    rasterio reads python file objects whole when opening them, so every block of an
+    asset is fetched and cached, whatever window is read from it: the cache avoids
+    downloading an asset again on the same worker, it doesn't reduce the bytes read
+    the first time. The missing blocks of a read are fetched concurrently with a
+    single cat_ranges call, so a cold read isn't a series of sequential requests.
+    The "vsi" io engine lets GDAL read only the ranges it needs, but doesn't go
+    through this cache.
+
+    Args:
+        cache_dir (str): the local directory to store the blocks
+        max_bytes (int): max size of the cache in bytes
+        block_size (int): size of the fetched byte ranges
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 2 * 1024 ** 3,
+        block_size: int = 2 * 1024 ** 2,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self._blocks: OrderedDict = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_existing_blocks()
+
+    def _load_existing_blocks(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(entries):
+            self._blocks[name] = size
+            self.total_bytes += size
+
+        self._evict()
+
+    def _key(self, href: str, block: int) -> str:
+        start = block * self.block_size
+        key = f"{href}:{start}-{start + self.block_size}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _evict(self):
+        to_remove = []
+        with self._lock:
+            while self.total_bytes > self.max_bytes and self._blocks:
+                key, size = self._blocks.popitem(last=False)
+                self.total_bytes -= size
+                self.evictions += 1
+                to_remove.append(key)
+
+        for key in to_remove:
+            try:
+                os.remove(os.path.join(self.cache_dir, key))
+            except FileNotFoundError:
+                pass
+
+    def size(self, fs: Any, href: str) -> int:
+        """Get the size of a remote file, only asking the fs the first time."""
+        size = self._sizes.get(href)
+        if size is None:
+            size = fs.size(href)
+            self._sizes[href] = size
+        return size
+
+    def get_block(self, fs: Any, href: str, block: int) -> bytes:
+        """Get a block of a remote file, fetching it only if it is not cached.
+
+        Args:
+            fs (Any): the cloud_fs to access the files
+            href (str): the file href
+            block (int): the block index
+
+        Returns:
+            bytes: the block content
+        """
+        key = self._key(href, block)
+        path = os.path.join(self.cache_dir, key)
+
+        with self._lock:
+            cached = key in self._blocks
+            if cached:
+                self._blocks.move_to_end(key)
+
+        if cached:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                with self._lock:
+                    self.hits += 1
+                return data
+            except FileNotFoundError:
+                # evicted by another thread in the meantime
+                pass
+
+        with self._lock:
+            self.misses += 1
+        start = block * self.block_size
+        end = min(start + self.block_size, self.size(fs, href))
+        data = fs.cat_file(href, start=start, end=end)
+        self._put_block(key, data)
+        self._evict()
+
+        return data
+
+    def fetch_missing_blocks(
+        self,
+        fs: Any,
+        href: str,
+        blocks: List[int],
+    ) -> Dict[int, bytes]:
+        """Fetch the blocks of a remote file that are not cached, concurrently with a
+        single cat_ranges call, and cache them.
+
+        Args:
+            fs (Any): the cloud_fs to access the files
+            href (str): the file href
+            blocks (List[int]): the blocks indices
+
+        Returns:
+            Dict[int, bytes]: the content of the fetched blocks, by block index
+        """
+        with self._lock:
+            missing = [b for b in blocks if self._key(href, b) not in self._blocks]
+            self.misses += len(missing)
+        if not missing:
+            return {}
+
+        size = self.size(fs, href)
+        starts = [block * self.block_size for block in missing]
+        ends = [min(start + self.block_size, size) for start in starts]
+        datas = fs.cat_ranges([href] * len(missing), starts, ends)
+
+        for block, data in zip(missing, datas):
+            self._put_block(self._key(href, block), data)
+        self._evict()
+
+        return dict(zip(missing, datas))
+
+    def _put_block(self, key: str, data: bytes):
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if key not in self._blocks:
+                self.total_bytes += len(data)
+            self._blocks[key] = len(data)
+            self._blocks.move_to_end(key)
+
+    def open(self, fs: Any, href: str) -> "BlockCachedFile":
+        """Open a remote file reading through the cache.
+
+        Args:
+            fs (Any): the cloud_fs to access the files
+            href (str): the file href
+
+        Returns:
+            BlockCachedFile: a read only file object
+        """
+        return BlockCachedFile(self, fs, href)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "blocks": len(self._blocks),
+            "bytes": self.total_bytes,
+        }
+
+
+class BlockCachedFile(io.RawIOBase):
+    """Read only file object over a remote file, reading through a DiskBlockCache."""
+
+    def __init__(self, cache: DiskBlockCache, fs: Any, href: str):
+        self._cache = cache
+        self._fs = fs
+        self.name = href
+        self._size = cache.size(fs, href)
+        self._pos = 0
+        # keep the last block in memory, reads are usually much smaller than a block
+        self._block = -1
+        self._block_data = b""
+        # blocks fetched ahead for the current read, not read from disk again
+        self._fetched: Dict[int, bytes] = {}
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def _read_block(self, block: int) -> bytes:
+        if block != self._block:
+            data = self._fetched.pop(block, None)
+            if data is None:
+                data = self._cache.get_block(self._fs, self.name, block)
+            self._block_data = data
+            self._block = block
+        return self._block_data
+
+    def readinto(self, b) -> int:
+        n = min(len(b), max(self._size - self._pos, 0))
+        view = memoryview(b).cast("B")
+        out = 0
+        if n > 0:
+            first = self._pos // self._cache.block_size
+            last = (self._pos + n - 1) // self._cache.block_size
+            if last > first:
+                self._fetched = self._cache.fetch_missing_blocks(
+                    self._fs,
+                    self.name,
+                    [block for block in range(first, last + 1) if block != self._block],
+                )
+        while out < n:
+            block, offset = divmod(self._pos, self._cache.block_size)
+            data = self._read_block(block)[offset : offset + n - out]
+            view[out : out + len(data)] = data
+            out += len(data)
+            self._pos += len(data)
+        self._fetched = {}
+        return out
+
+    def readall(self) -> bytes:
+        data = bytearray(max(self._size - self._pos, 0))
+        self.readinto(data)
+        return bytes(data)
+
+
+_block_cache: Optional[DiskBlockCache] = None
+
+
+def configure_block_cache(
+    cache_dir: Optional[str],
+    max_bytes: int = 2 * 1024 ** 3,
+    block_size: int = 2 * 1024 ** 2,
+) -> Optional[DiskBlockCache]:
+    """Set up the process level disk block cache used by the extractor to read
+    the assets with the "fsspec" io engine. An empty cache_dir disables it.
+    The whole assets are cached, see DiskBlockCache.
+
+    Args:
+        cache_dir (Optional[str]): the local directory to store the blocks
+        max_bytes (int, optional): max size of the cache in bytes. Defaults to 2GB.
+        block_size (int, optional): size of the fetched byte ranges. Defaults to 2MB.
+
+    Returns:
+        Optional[DiskBlockCache]: the cache, None if disabled
+    """
+    global _block_cache
+
+    if cache_dir:
+        logger.info(f"Caching up to {max_bytes} bytes of asset blocks in {cache_dir}.")
+        _block_cache = DiskBlockCache(cache_dir, max_bytes, block_size)
+    else:
+        _block_cache = None
+
+    return _block_cache
+
+
+def get_block_cache() -> Optional[DiskBlockCache]:
+    return _block_cache
+
+
+def open_file(fs: Any, href: str) -> Any:
+    """Open a remote file, through the disk block cache if configured.
+
+    Args:
+        fs (Any): the cloud_fs to access the files
+        href (str): the file href
+
+    Returns:
+        Any: a read only file object
+    """
+    if _block_cache is None:
+        return fs.open(href)
+    return _block_cache.open(fs, href)
@@ -0,0 +1,268 @@
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+
+import attr
+import rasterio
+from loguru import logger
+from satextractor.extractor.io_engine import gdal_env
+from satextractor.extractor.io_engine import open_raster
+
+
+@attr.s(frozen=True)
+class DatasetHeader:
+    """Header metadata of a raster asset
+
+    Args:
+        crs (rasterio.crs.CRS): the raster crs
+        transform (affine.Affine): the raster transform
+        width (int): the raster width in pixels
+        height (int): the raster height in pixels
+        bounds (rasterio.coords.BoundingBox): the raster bounds in its crs
+        dtype (str): the raster data type
+    """
+
+    crs: rasterio.crs.CRS = attr.ib()
+    transform: Any = attr.ib()
+    width: int = attr.ib()
+    height: int = attr.ib()
+    bounds: Any = attr.ib()
+    dtype: str = attr.ib()
+
+    @classmethod
+    def from_dataset(cls, ds: rasterio.io.DatasetReader) -> "DatasetHeader":
+        return cls(ds.crs, ds.transform, ds.width, ds.height, ds.bounds, ds.dtypes[0])
+
+
+class _CachedDataset:
+    def __init__(self, fs: Any, href: str):
+        self._stack = contextlib.ExitStack()
+        self.dataset = self._stack.enter_context(open_raster(fs, href))
+        self.header = DatasetHeader.from_dataset(self.dataset)
+        self.opened_at = time.monotonic()
+        self.closed = False
+        # rasterio datasets can't be read from several threads at once
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            self._stack.close()
+            self.closed = True
+
+
+class DatasetCache:
+    """Process level LRU cache of opened rasterio datasets and their headers, keyed
+    by asset href. Entries are evicted when the cache is full or older than ttl.
+
+    Args:
+        maxsize (int): max number of open datasets
+        ttl (float): seconds an entry is kept after being opened
+        header_maxsize (int): max number of cached headers
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 8,
+        ttl: float = 300,
+        header_maxsize: int = 1024,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.header_maxsize = header_maxsize
+        self._datasets: OrderedDict = OrderedDict()
+        self._headers: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.header_hits = 0
+        self.header_misses = 0
+
+    def _expired(self, opened_at: float) -> bool:
+        return time.monotonic() - opened_at > self.ttl
+
+    def _get_dataset(self, fs: Any, href: str) -> _CachedDataset:
+        evicted = []
+        with self._lock:
+            entry = self._datasets.get(href)
+            if entry is not None and self._expired(entry.opened_at):
+                evicted.append(self._datasets.pop(href))
+                self.evictions += 1
+                entry = None
+            if entry is not None:
+                self._datasets.move_to_end(href)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            new_entry = _CachedDataset(fs, href)
+            with self._lock:
+                # another thread may have opened the same href in the meantime
+                entry = self._datasets.setdefault(href, new_entry)
+                self._datasets.move_to_end(href)
+                self._set_header(href, entry.header, entry.opened_at)
+                while len(self._datasets) > self.maxsize:
+                    evicted.append(self._datasets.popitem(last=False)[1])
+                    self.evictions += 1
+            if entry is not new_entry:
+                evicted.append(new_entry)
+
+        for old_entry in evicted:
+            old_entry.close()
+
+        return entry
+
+    def _set_header(self, href: str, header: DatasetHeader, opened_at: float):
+        self._headers[href] = (header, opened_at)
+        self._headers.move_to_end(href)
+        while len(self._headers) > self.header_maxsize:
+            self._headers.popitem(last=False)
+
+    @contextlib.contextmanager
+    def open(self, fs: Any, href: str) -> Iterator[rasterio.io.DatasetReader]:
+        """Open an asset, reusing the dataset if it is cached.
+        The dataset is locked for the calling thread until the context exits.
+
+        Args:
+            fs (Any): the cloud_fs to access the files
+            href (str): the asset href
+
+        Yields:
+            Iterator[rasterio.io.DatasetReader]: the opened dataset
+        """
+        if self.maxsize <= 0:
+            with open_raster(fs, href) as ds:
+                yield ds
+            return
+
+        while True:
+            entry = self._get_dataset(fs, href)
+            with entry.lock:
+                # the entry may have been evicted before we got the lock
+                if not entry.closed:
+                    yield entry.dataset
+                    return
+
+    def header(self, fs: Any, href: str) -> DatasetHeader:
+        """Get the header of an asset, opening it only if it is not cached.
+
+        Args:
+            fs (Any): the cloud_fs to access the files
+            href (str): the asset href
+
+        Returns:
+            DatasetHeader: the asset header
+        """
+        with self._lock:
+            cached = self._headers.get(href)
+            if cached is not None and not self._expired(cached[1]):
+                self._headers.move_to_end(href)
+                self.header_hits += 1
+                return cached[0]
+            self.header_misses += 1
+
+        with self.open(fs, href) as ds:
+            header = DatasetHeader.from_dataset(ds)
+        with self._lock:
+            self._set_header(href, header, time.monotonic())
+        return header
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._datasets.values())
+            self._datasets.clear()
+            self._headers.clear()
+        for entry in entries:
+            entry.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "header_hits": self.header_hits,
+            "header_misses": self.header_misses,
+            "open_datasets": len(self._datasets),
+        }
+
+
+_dataset_cache: Optional[DatasetCache] = None
+
+
+def configure_dataset_cache(
+    maxsize: int,
+    ttl: float = 300,
+    header_maxsize: int = 1024,
+) -> Optional[DatasetCache]:
+    """Set up the process level dataset cache used by the extractor.
+    A maxsize of 0 disables it.
+
+    Args:
+        maxsize (int): max number of open datasets
+        ttl (float, optional): seconds an entry is kept after being opened. Defaults to 300.
+        header_maxsize (int, optional): max number of cached headers. Defaults to 1024.
+
+    Returns:
+        Optional[DatasetCache]: the cache, None if disabled
+    """
+    global _dataset_cache
+
+    if _dataset_cache is not None:
+        _dataset_cache.clear()
+
+    if maxsize > 0:
+        logger.info(f"Caching up to {maxsize} open datasets for {ttl}s.")
+        _dataset_cache = DatasetCache(maxsize, ttl, header_maxsize)
+    else:
+        _dataset_cache = None
+
+    return _dataset_cache
+
+
+def get_dataset_cache() -> Optional[DatasetCache]:
+    return _dataset_cache
+
+
+@contextlib.contextmanager
+def open_dataset(fs: Any, href: str) -> Iterator[rasterio.io.DatasetReader]:
+    """Open an asset as a rasterio dataset with the configured io engine, through the
+    dataset and block caches if configured. The dataset is read within the GDAL env.
+
+    Args:
+        fs (Any): the cloud_fs to access the files
+        href (str): the asset href
+
+    Yields:
+        Iterator[rasterio.io.DatasetReader]: the opened dataset
+    """
+    with gdal_env():
+        if _dataset_cache is None:
+            with open_raster(fs, href) as ds:
+                yield ds
+        else:
+            with _dataset_cache.open(fs, href) as ds:
+                yield ds
+
+
+def get_dataset_header(fs: Any, href: str) -> DatasetHeader:
+    """Get the header of an asset, from the header cache of the dataset cache if
+    configured, so that looking up the bounds of an asset doesn't open it again.
+
+    Args:
+        fs (Any): the cloud_fs to access the files
+        href (str): the asset href
+
+    Returns:
+        DatasetHeader: the asset header
+    """
+    if _dataset_cache is None:
+        with open_dataset(fs, href) as ds:
+            return DatasetHeader.from_dataset(ds)
+    with gdal_env():
+        return _dataset_cache.header(fs, href)
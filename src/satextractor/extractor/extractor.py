@@ -1,9 +1,21 @@
+import math
 import os
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import Optional
 from typing import Tuple
+from typing import Union
 
+import attr
 import numpy as np
+import pystac
 import rasterio
 from affine import Affine
 from loguru import logger
@@ -11,41 +23,67 @@ from rasterio import warp
 from rasterio.crs import CRS
 from rasterio.enums import Resampling
 from rasterio.merge import merge as riomerge
+from satextractor.extractor.cache import get_dataset_cache
+from satextractor.extractor.cache import get_dataset_header
+from satextractor.extractor.cache import open_dataset
+from satextractor.extractor.io_engine import get_io_engine
+from satextractor.models import BAND_INFO
 from satextractor.models import ExtractionTask
+from satextractor.models import MultiBandExtractionTask
 from satextractor.models import Tile
 
 
+def get_tiles_bounds(tiles: List[Tile]) -> np.ndarray:
+    """Get the bounds of the tiles as an array.
+
+    Args:
+        tiles (List[Tile]): the tiles
+
+    Returns:
+        np.ndarray: a (n_tiles, 4) array of min_x, min_y, max_x, max_y
+    """
+    return np.array([tile.bbox for tile in tiles], dtype=np.float64).reshape(-1, 4)
+
+
 def get_window_union(
     tiles: List[Tile],
     ds: rasterio.io.DatasetReader,
+    bounds: Optional[Tuple[float, float, float, float]] = None,
 ) -> rasterio.windows.Window:
-
     """Get the window union to read all tiles from the geotiff.
 
+    All the tiles share the same CRS, so the union is computed from their aggregate
+    bounds with a single reprojection. When the raster is in another CRS the
+    densified reprojected bounds contain all the individual tile windows.
+
     Args:
         tiles (List[Tile]): the tiles
         ds (rasterio.io.DatasetReader): the rasterio dataset to read (for the transform)
+        bounds (Optional[Tuple[float, float, float, float]], optional): the bounds to read
+            in the tiles CRS. Defaults to the tiles aggregate bounds.
 
     Returns:
         rasterio.windows.Window: The union of all tile windows.
     """
+    if bounds is None:
+        tiles_bounds = get_tiles_bounds(tiles)
+        left, bottom = tiles_bounds[:, :2].min(axis=0)
+        right, top = tiles_bounds[:, 2:].max(axis=0)
+    else:
+        left, bottom, right, top = bounds
 
-    windows = []
-
-    for tile in tiles:
-
-        bounds_arr_tile_crs = tile.bbox
-        bounds_arr_rast_crs = warp.transform_bounds(
-            CRS.from_epsg(tile.epsg),
+    tiles_crs = CRS.from_epsg(tiles[0].epsg)
+    if tiles_crs != ds.crs:
+        left, bottom, right, top = warp.transform_bounds(
+            tiles_crs,
             ds.crs,
-            *bounds_arr_tile_crs,
+            left,
+            bottom,
+            right,
+            top,
         )
 
-        window = rasterio.windows.from_bounds(*bounds_arr_rast_crs, ds.transform)
-
-        windows.append(window)
-
-    return rasterio.windows.union(windows)
+    return rasterio.windows.from_bounds(left, bottom, right, top, ds.transform)
 
 
 def get_proj_win(tiles: List[Tile]) -> Tuple[int, int, int, int]:
@@ -57,10 +95,11 @@ def get_proj_win(tiles: List[Tile]) -> Tuple[int, int, int, int]:
     Returns:
         [Tuple[int, int, int, int]]: upperleft_x,upperleft_y,lowerright_x,lowerright_y
     """
-    ulx = min([t.bbox[0] for t in tiles])
-    uly = max([t.bbox[3] for t in tiles])
-    lrx = max([t.bbox[2] for t in tiles])
-    lry = min([t.bbox[1] for t in tiles])
+    bounds = get_tiles_bounds(tiles)
+    ulx = bounds[:, 0].min()
+    uly = bounds[:, 3].max()
+    lrx = bounds[:, 2].max()
+    lry = bounds[:, 1].min()
     return int(ulx), int(uly), int(lrx), int(lry)
 
 
@@ -82,53 +121,183 @@ def get_tile_pixel_coords(tiles: List[Tile], raster_file: str) -> List[Tuple[int
     return list(zip(rows, cols))
 
 
+def get_task_grid(
+    tiles: List[Tile],
+    resolution: float,
+) -> Tuple[Affine, Tuple[int, int]]:
+    """Get the target grid covering all the tiles of a task.
+
+    Args:
+        tiles (List[Tile]): the tiles, all in the same CRS
+        resolution (float): the target resolution
+
+    Returns:
+        Tuple[Affine, Tuple[int, int]]: the grid transform and its (height, width) shape
+    """
+    left, top, right, bottom = get_proj_win(tiles)
+    transform = Affine(resolution, 0.0, left, 0.0, -resolution, top)
+    shape = (
+        int(math.ceil((top - bottom) / resolution)),
+        int(math.ceil((right - left) / resolution)),
+    )
+    return transform, shape
+
+
+def get_grid_bounds(
+    transform: Affine,
+    shape: Tuple[int, int],
+) -> Tuple[float, float, float, float]:
+    """Get the bounds of a grid.
+
+    Args:
+        transform (Affine): the grid transform
+        shape (Tuple[int, int]): the grid (height, width)
+
+    Returns:
+        Tuple[float, float, float, float]: min_x, min_y, max_x, max_y
+    """
+    left, top = transform.c, transform.f
+    return (
+        left,
+        top + transform.e * shape[0],
+        left + transform.a * shape[1],
+        top,
+    )
+
+
+def get_band_resampling(band: str) -> Resampling:
+    """Get the resampling used to read a band. Quality bands are never interpolated.
+
+    Args:
+        band (str): the band name
+
+    Returns:
+        Resampling: the rasterio resampling method
+    """
+    if band == "BQA":
+        return Resampling.nearest
+    return Resampling.bilinear
+
+
+def read_asset_window(
+    fs: Any,
+    url: str,
+    tiles: List[Tile],
+    out_shape: Tuple[int, int],
+    resampling: Resampling,
+    bounds: Optional[Tuple[float, float, float, float]] = None,
+) -> np.ndarray:
+    """Read from an asset the window covering all the tiles.
+
+    Args:
+        fs (Any): the cloud_fs to access the files
+        url (str): the asset url
+        tiles (List[Tile]): the tiles
+        out_shape (Tuple[int, int]): the (height, width) of the output array
+        resampling (Resampling): the resampling method
+        bounds (Optional[Tuple[float, float, float, float]], optional): the bounds to read
+            in the tiles CRS. Defaults to the tiles aggregate bounds.
+
+    Returns:
+        np.ndarray: the window of the asset resampled to out_shape
+    """
+    with open_dataset(fs, url) as ds:
+        window = get_window_union(tiles, ds, bounds)
+
+        return ds.read(
+            1,
+            window=window,
+            out_shape=out_shape,
+            fill_value=0,
+            boundless=True,
+            resampling=resampling,
+        )
+
+
+def read_assets_windows(
+    fs: Any,
+    urls: List[str],
+    tiles: List[Tile],
+    out_shape: Tuple[int, int],
+    resampling: Resampling,
+    max_workers: int = 1,
+    bounds: Optional[Tuple[float, float, float, float]] = None,
+) -> Iterator[np.ndarray]:
+    """Read from each asset the window covering all the tiles, using a bounded
+    thread pool. The windows are yielded in the same order as the urls and at most
+    max_workers of them are read ahead of the consumer.
+
+    Args:
+        fs (Any): the cloud_fs to access the files
+        urls (List[str]): the assets urls
+        tiles (List[Tile]): the tiles
+        out_shape (Tuple[int, int]): the (height, width) of the output arrays
+        resampling (Resampling): the resampling method
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
+        bounds (Optional[Tuple[float, float, float, float]], optional): the bounds to read
+            in the tiles CRS. Defaults to the tiles aggregate bounds.
+
+    Yields:
+        Iterator[np.ndarray]: the window of each asset resampled to out_shape
+    """
+
+    def read(url: str) -> np.ndarray:
+        return read_asset_window(fs, url, tiles, out_shape, resampling, bounds)
+
+    if max_workers <= 1 or len(urls) <= 1:
+        for url in urls:
+            yield read(url)
+        return
+
+    # submit at most max_workers reads ahead, so the windows held in memory don't
+    # grow with the number of assets when merging is slower than reading
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        futures: Deque[Future] = deque()
+        for url in urls:
+            if len(futures) >= max_workers:
+                yield futures.popleft().result()
+            futures.append(executor.submit(read, url))
+        while futures:
+            yield futures.popleft().result()
+
+
 def download_and_extract_tiles_window(
     fs: Any,
     task: ExtractionTask,
     resolution: int,
+    max_workers: int = 1,
 ) -> List[str]:
     """Download and extract from the task assets the data for the window from each asset.
 
     Args:
         task (ExtractionTask): The extraction task
         resolution (int): The target resolution
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
 
     Returns:
         List[str]: A list of files that store the crops of the original assets
     """
 
     # task tiles all have same CRS, so get their max extents and crs
-    left, top, right, bottom = get_proj_win(task.tiles)
+    dst_transform, out_shp = get_task_grid(task.tiles, resolution)
     epsg = task.tiles[0].epsg
 
-    # set the transforms for the output file
-    dst_transform = Affine(resolution, 0.0, left, 0.0, -resolution, top)
-    out_shp = (int((right - left) / resolution), int((top - bottom) / resolution))
-
     outfiles = []
 
     band = task.band
     urls = [item.assets[band].href for item in task.item_collection.items]
+    resampling = get_band_resampling(band)
 
-    for ii, url in enumerate(urls):
-        with fs.open(url) as f:
-            with rasterio.open(f) as ds:
-                window = get_window_union(task.tiles, ds)
-
-                if task.band == "BQA":
-                    resampling = Resampling.nearest
-                else:
-                    resampling = Resampling.bilinear
-
-                rst_arr = ds.read(
-                    1,
-                    window=window,
-                    out_shape=out_shp,
-                    fill_value=0,
-                    boundless=True,
-                    resampling=resampling,
-                )
+    rst_arrs = read_assets_windows(
+        fs,
+        urls,
+        task.tiles,
+        out_shp,
+        resampling,
+        max_workers,
+    )
 
+    for ii, rst_arr in enumerate(rst_arrs):
         out_f = f"{task.task_id}_{ii}.tif"
 
         with rasterio.open(
@@ -136,8 +305,8 @@ def download_and_extract_tiles_window(
             "w",
             driver="GTiff",
             count=1,
-            width=out_shp[0],
-            height=out_shp[1],
+            width=out_shp[1],
+            height=out_shp[0],
             transform=dst_transform,
             crs=CRS.from_epsg(epsg),
             dtype=rst_arr.dtype,
@@ -150,27 +319,547 @@ def download_and_extract_tiles_window(
     return outfiles
 
 
+def merge_into(
+    dst: np.ndarray,
+    src: np.ndarray,
+    method: str = "max",
+    nodata: int = 0,
+) -> np.ndarray:
+    """Merge an array into a mosaic in place, ignoring nodata pixels.
+    Follows the semantics of the rasterio.merge methods.
+
+    Args:
+        dst (np.ndarray): the mosaic, modified in place
+        src (np.ndarray): the array to merge, same shape as dst
+        method (str, optional): one of "first", "last", "min" or "max". Defaults to "max".
+        nodata (int, optional): the nodata value. Defaults to 0.
+
+    Returns:
+        np.ndarray: the mosaic
+    """
+    if method == "first":
+        np.copyto(dst, src, where=dst == nodata)
+    elif method == "last":
+        np.copyto(dst, src, where=src != nodata)
+    elif method in ("min", "max"):
+        reduced = np.maximum(dst, src) if method == "max" else np.minimum(dst, src)
+        src_valid = src != nodata
+        dst_valid = dst != nodata
+        np.copyto(dst, reduced, where=src_valid & dst_valid)
+        np.copyto(dst, src, where=src_valid & ~dst_valid)
+    else:
+        raise ValueError(f"Unknown merge method '{method}'")
+
+    return dst
+
+
+def sort_items_by_cloud_cover(items: List[pystac.Item]) -> List[pystac.Item]:
+    """Sort items by ascending eo:cloud_cover. Items without cloud cover go last.
+
+    Args:
+        items (List[pystac.Item]): the items
+
+    Returns:
+        List[pystac.Item]: the sorted items
+    """
+    return sorted(
+        items,
+        key=lambda item: item.properties.get("eo:cloud_cover", float("inf")),
+    )
+
+
+def get_tiles_mask(
+    tiles: List[Tile],
+    transform: Affine,
+    shape: Tuple[int, int],
+    resolution: float,
+) -> np.ndarray:
+    """Get a boolean mask of the pixels covered by the tiles on a grid.
+
+    Args:
+        tiles (List[Tile]): the tiles
+        transform (Affine): the grid transform
+        shape (Tuple[int, int]): the grid (height, width)
+        resolution (float): the grid resolution
+
+    Returns:
+        np.ndarray: True where a pixel belongs to a tile
+    """
+    mask = np.zeros(shape, dtype=bool)
+    for min_x, min_y, max_x, max_y in get_tiles_bounds(tiles):
+        col_start = int(math.floor((min_x - transform.c) / resolution))
+        col_end = int(math.ceil((max_x - transform.c) / resolution))
+        row_start = int(math.floor((transform.f - max_y) / resolution))
+        row_end = int(math.ceil((transform.f - min_y) / resolution))
+        mask[row_start:row_end, col_start:col_end] = True
+    return mask
+
+
+def task_mosaic_first_valid(
+    cloud_fs: Any,
+    task: ExtractionTask,
+    resolution: float = 10,
+    max_workers: int = 1,
+) -> Tuple[np.ndarray, Affine]:
+    """Build in memory a mosaic with the first valid pixel of the task assets sorted
+    by cloud cover. Assets are fetched in batches of max_workers and no more
+    assets are fetched once every pixel of every tile has a valid value.
+
+    Args:
+        cloud_fs (Any): the cloud_fs to access the files
+        task (ExtractionTask): The task
+        resolution (float, optional): The target resolution. Defaults to 10.
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
+
+    Returns:
+        Tuple[np.ndarray, Affine]: the mosaic and its transform
+    """
+    transform, out_shp = get_task_grid(task.tiles, resolution)
+    resampling = get_band_resampling(task.band)
+    items = sort_items_by_cloud_cover(task.item_collection.items)
+    urls = [item.assets[task.band].href for item in items]
+    tiles_mask = get_tiles_mask(task.tiles, transform, out_shp, resolution)
+    batch_size = max(max_workers, 1)
+
+    mosaic = np.zeros(out_shp, dtype=np.uint16)
+    for start in range(0, len(urls), batch_size):
+        rst_arrs = read_assets_windows(
+            cloud_fs,
+            urls[start : start + batch_size],
+            task.tiles,
+            out_shp,
+            resampling,
+            max_workers,
+            get_grid_bounds(transform, out_shp),
+        )
+        for rst_arr in rst_arrs:
+            merge_into(mosaic, rst_arr, "first")
+
+        if mosaic[tiles_mask].all():
+            skipped = len(urls) - start - batch_size
+            if skipped > 0:
+                logger.info(f"Tiles fully covered. Skipping {skipped} assets.")
+            break
+
+    return mosaic, transform
+
+
+def task_mosaic_array(
+    cloud_fs: Any,
+    task: ExtractionTask,
+    method: str = "max",
+    resolution: float = 10,
+    max_workers: int = 1,
+) -> Tuple[np.ndarray, Affine]:
+    """Build in memory the mosaic of the task assets over the task tiles extent.
+
+    Args:
+        cloud_fs (Any): the cloud_fs to access the files
+        task (ExtractionTask): The task
+        method (str, optional): The method to use while merging the assets, or
+            "first_valid" to stop reading assets once the tiles are covered. Defaults to "max".
+        resolution (float, optional): The target resolution. Defaults to 10.
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
+
+    Returns:
+        Tuple[np.ndarray, Affine]: the mosaic and its transform
+    """
+    if method == "first_valid":
+        return task_mosaic_first_valid(cloud_fs, task, resolution, max_workers)
+
+    transform, out_shp = get_task_grid(task.tiles, resolution)
+    resampling = get_band_resampling(task.band)
+    urls = [item.assets[task.band].href for item in task.item_collection.items]
+
+    rst_arrs = read_assets_windows(
+        cloud_fs,
+        urls,
+        task.tiles,
+        out_shp,
+        resampling,
+        max_workers,
+        get_grid_bounds(transform, out_shp),
+    )
+
+    # assets are merged in order, so the mosaic doesn't depend on the read order
+    mosaic = None
+    for rst_arr in rst_arrs:
+        if mosaic is None:
+            mosaic = rst_arr
+        else:
+            merge_into(mosaic, rst_arr, method)
+
+    if mosaic is None:
+        mosaic = np.zeros(out_shp, dtype=np.uint16)
+
+    return mosaic, transform
+
+
+def get_tile_patches(
+    mosaic: np.ndarray,
+    tiles: List[Tile],
+    transform: Affine,
+    resolution: int,
+) -> List[np.ndarray]:
+    """Slice the tile patches from a mosaic.
+
+    Args:
+        mosaic (np.ndarray): the mosaic covering all the tiles
+        tiles (List[Tile]): the tiles
+        transform (Affine): the mosaic transform
+        resolution (int): the mosaic resolution
+
+    Returns:
+        List[np.ndarray]: The tile patches as numpy arrays
+    """
+    patches = []
+    for tile in tiles:
+        px = int(round((tile.min_x - transform.c) / resolution))
+        py = int(round((transform.f - tile.max_y) / resolution))
+        width = tile.bbox_size_x // resolution
+        height = tile.bbox_size_y // resolution
+        patches.append(mosaic[py : py + height, px : px + width])
+    return patches
+
+
+def get_task_gsd(task: ExtractionTask) -> float:
+    """Get the native resolution of the task band, from the assets gsd or BAND_INFO.
+
+    Args:
+        task (ExtractionTask): The task
+
+    Returns:
+        float: the band ground sample distance
+    """
+    for item in task.item_collection.items:
+        gsd = item.assets[task.band].extra_fields.get("gsd")
+        if gsd is not None:
+            return float(gsd)
+    return float(BAND_INFO[task.constellation][task.band]["gsd"])
+
+
+def upsample_axis(arr: np.ndarray, coords: np.ndarray, axis: int, nearest: bool):
+    """Interpolate an array along one axis at the given fractional pixel coords.
+
+    Args:
+        arr (np.ndarray): the array to interpolate
+        coords (np.ndarray): the pixel center coords to sample, in arr pixels
+        axis (int): the axis to interpolate
+        nearest (bool): use the nearest neighbour instead of a linear interpolation
+
+    Returns:
+        np.ndarray: the interpolated array, as float32 if linear
+    """
+    size = arr.shape[axis]
+    coords = np.clip(coords, 0, size - 1)
+
+    if nearest:
+        return np.take(arr, np.rint(coords).astype(np.int64), axis=axis)
+
+    low = np.floor(coords).astype(np.int64)
+    high = np.minimum(low + 1, size - 1)
+    weights_shape = [1] * arr.ndim
+    weights_shape[axis] = -1
+    weights = (coords - low).astype(np.float32).reshape(weights_shape)
+
+    return np.take(arr, low, axis=axis) * (1 - weights) + np.take(
+        arr,
+        high,
+        axis=axis,
+    ) * weights
+
+
+def get_upsampled_tile_patches(
+    mosaic: np.ndarray,
+    tiles: List[Tile],
+    transform: Affine,
+    resolution: int,
+    resampling: Resampling,
+) -> List[np.ndarray]:
+    """Get the tile patches at the target resolution from a coarser mosaic,
+    with a separable bilinear (or nearest) interpolation.
+
+    Args:
+        mosaic (np.ndarray): the mosaic covering all the tiles, at its native resolution
+        tiles (List[Tile]): the tiles
+        transform (Affine): the mosaic transform
+        resolution (int): the target resolution
+        resampling (Resampling): Resampling.nearest or Resampling.bilinear
+
+    Returns:
+        List[np.ndarray]: The tile patches as numpy arrays
+    """
+    scale = resolution / transform.a
+    nearest = resampling == Resampling.nearest
+
+    patches = []
+    for tile in tiles:
+        px = (tile.min_x - transform.c) / resolution
+        py = (transform.f - tile.max_y) / resolution
+        width = tile.bbox_size_x // resolution
+        height = tile.bbox_size_y // resolution
+
+        # target pixel centers in mosaic pixel coords
+        rows = (py + np.arange(height) + 0.5) * scale - 0.5
+        cols = (px + np.arange(width) + 0.5) * scale - 0.5
+
+        # only interpolate the part of the mosaic under the tile
+        row_start = max(int(np.floor(rows[0])), 0)
+        col_start = max(int(np.floor(cols[0])), 0)
+        row_end = int(np.ceil(rows[-1])) + 1
+        col_end = int(np.ceil(cols[-1])) + 1
+        block = mosaic[row_start:row_end, col_start:col_end]
+
+        patch = upsample_axis(block, rows - row_start, 0, nearest)
+        patch = upsample_axis(patch, cols - col_start, 1, nearest)
+        if not nearest:
+            patch = np.rint(patch).astype(mosaic.dtype)
+        patches.append(patch)
+
+    return patches
+
+
+def get_mosaic_patches(
+    mosaic: np.ndarray,
+    tiles: List[Tile],
+    transform: Affine,
+    resolution: int,
+    band: str,
+) -> List[np.ndarray]:
+    """Get the tile patches at the target resolution from a mosaic, upsampling them
+    if the mosaic is coarser.
+
+    Args:
+        mosaic (np.ndarray): the mosaic covering all the tiles
+        tiles (List[Tile]): the tiles
+        transform (Affine): the mosaic transform
+        resolution (int): the target resolution
+        band (str): the mosaic band
+
+    Returns:
+        List[np.ndarray]: The tile patches as numpy arrays
+    """
+    if transform.a == resolution:
+        return get_tile_patches(mosaic, tiles, transform, resolution)
+
+    return get_upsampled_tile_patches(
+        mosaic,
+        tiles,
+        transform,
+        resolution,
+        get_band_resampling(band),
+    )
+
+
+def get_assets_bounds(
+    fs: Any,
+    urls: List[str],
+    epsg: str,
+    max_workers: int = 1,
+) -> np.ndarray:
+    """Get the bounds of the assets rasters in the tiles CRS. Rasters in another CRS
+    get the bounds of their densified reprojected extent, which contain it.
+
+    Args:
+        fs (Any): the cloud_fs to access the files
+        urls (List[str]): the assets urls
+        epsg (str): the tiles epsg
+        max_workers (int, optional): max number of assets opened concurrently. Defaults to 1.
+
+    Returns:
+        np.ndarray: a (n_assets, 4) array of min_x, min_y, max_x, max_y
+    """
+    tiles_crs = CRS.from_epsg(epsg)
+
+    def read_bounds(url: str) -> Tuple[float, float, float, float]:
+        header = get_dataset_header(fs, url)
+        if header.crs == tiles_crs:
+            left, bottom, right, top = header.bounds
+            return left, bottom, right, top
+        return warp.transform_bounds(header.crs, tiles_crs, *header.bounds)
+
+    n_workers = max(min(max_workers, len(urls)), 1)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        bounds = list(executor.map(read_bounds, urls))
+
+    return np.array(bounds, dtype=np.float64).reshape(-1, 4)
+
+
+def group_tiles_by_assets(
+    tiles: List[Tile],
+    assets_bounds: np.ndarray,
+) -> Dict[Tuple[int, ...], List[int]]:
+    """Group the tiles by the set of assets overlapping them.
+
+    Args:
+        tiles (List[Tile]): the tiles
+        assets_bounds (np.ndarray): the (n_assets, 4) bounds of the assets in the tiles CRS
+
+    Returns:
+        Dict[Tuple[int, ...], List[int]]: the tiles indices for each tuple of assets indices
+    """
+    tiles_bounds = get_tiles_bounds(tiles)[:, np.newaxis]
+    assets_bounds = assets_bounds[np.newaxis]
+    overlaps = (
+        (tiles_bounds[..., 0] < assets_bounds[..., 2])
+        & (tiles_bounds[..., 2] > assets_bounds[..., 0])
+        & (tiles_bounds[..., 1] < assets_bounds[..., 3])
+        & (tiles_bounds[..., 3] > assets_bounds[..., 1])
+    )
+
+    groups: Dict[Tuple[int, ...], List[int]] = {}
+    for i, tile_overlaps in enumerate(overlaps):
+        groups.setdefault(tuple(np.flatnonzero(tile_overlaps)), []).append(i)
+    return groups
+
+
+def task_mosaic_grouped_patches(
+    cloud_fs: Any,
+    task: ExtractionTask,
+    method: str = "max",
+    resolution: int = 10,
+    read_resolution: Optional[float] = None,
+    max_workers: int = 1,
+) -> List[np.ndarray]:
+    """Get the tile patches of a task, mosaicking each group of tiles only with the
+    assets overlapping them instead of mosaicking the whole task extent.
+    Tiles overlapped by a single asset are read directly from it without merging,
+    only the tiles straddling assets edges are merged.
+
+    Args:
+        cloud_fs (Any): the cloud_fs to access the files
+        task (ExtractionTask): The task
+        method (str, optional): The method to use while merging the assets. Defaults to "max".
+        resolution (int, optional): The target resolution. Defaults to 10.
+        read_resolution (Optional[float], optional): the resolution of the mosaics.
+            Defaults to the target resolution.
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
+
+    Returns:
+        List[np.ndarray]: The tile patches as numpy arrays
+    """
+    read_resolution = read_resolution or resolution
+    items = task.item_collection.items
+    urls = [item.assets[task.band].href for item in items]
+    assets_bounds = get_assets_bounds(cloud_fs, urls, task.tiles[0].epsg, max_workers)
+    groups = group_tiles_by_assets(task.tiles, assets_bounds)
+
+    n_direct = sum(len(tiles_idx) for k, tiles_idx in groups.items() if len(k) == 1)
+    logger.info(
+        f"Reading {n_direct} of {len(task.tiles)} tiles from a single asset, "
+        f"merging the rest in {sum(len(k) > 1 for k in groups)} groups.",
+    )
+
+    def group_patches(group: Tuple[Tuple[int, ...], List[int]]) -> List[np.ndarray]:
+        assets_idx, tiles_idx = group
+        group_task = attr.evolve(
+            task,
+            tiles=[task.tiles[i] for i in tiles_idx],
+            item_collection=pystac.ItemCollection(
+                [items[i] for i in assets_idx],
+                clone_items=False,
+            ),
+        )
+        mosaic, transform = task_mosaic_array(
+            cloud_fs,
+            group_task,
+            method,
+            read_resolution,
+        )
+        return get_mosaic_patches(
+            mosaic,
+            group_task.tiles,
+            transform,
+            resolution,
+            task.band,
+        )
+
+    # each group reads its assets one at a time, so at most max_workers are read at
+    # once, and every tile is in a single group, its patch is put back in its place
+    patches: Dict[int, np.ndarray] = {}
+    n_workers = max(min(max_workers, len(groups)), 1)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for tiles_idx, group_patches_list in zip(
+            groups.values(),
+            executor.map(group_patches, groups.items()),
+        ):
+            for i, patch in zip(tiles_idx, group_patches_list):
+                patches[i] = patch
+
+    return [patches[i] for i in range(len(task.tiles))]
+
+
 def task_mosaic_patches(
     cloud_fs: Any,
     task: ExtractionTask,
     method: str = "max",
     resolution: int = 10,
     dst_path="merged.jp2",
+    in_memory: bool = False,
+    max_workers: int = 1,
+    native_resolution: bool = False,
+    direct_reads: bool = False,
 ) -> List[np.ndarray]:
     """Get tile patches from the mosaic of a given task
 
     Args:
         cloud_fs (Any): the cloud_fs to access the files
         task (ExtractionTask): The task
-        method (str, optional): The method to use while merging the assets. Defaults to "max".
+        method (str, optional): The method to use while merging the assets. "first_valid"
+            takes the least cloudy valid pixel and is always run in memory. Defaults to "max".
         resolution (int, optional): The target resolution. Defaults to 10.
         dst_path (str): path to store the merged files
+        in_memory (bool, optional): build the mosaic in memory instead of writing the
+            crops and the merged file to local disk. Defaults to False.
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
+        native_resolution (bool, optional): for in memory mosaics of bands coarser than the
+            target resolution, read and mosaic at the band gsd and only upsample the tile
+            patches. Defaults to False.
+        direct_reads (bool, optional): for in memory mosaics, read the tiles overlapped
+            by a single asset directly from it and only merge the other tiles, see
+            task_mosaic_grouped_patches. Defaults to False.
 
     Returns:
         List[np.ndarray]: The tile patches as numpy arrays
     """
 
-    out_files = download_and_extract_tiles_window(cloud_fs, task, resolution)
+    if in_memory or method == "first_valid":
+        read_resolution: float = resolution
+        if native_resolution:
+            read_resolution = max(get_task_gsd(task), resolution)
+
+        if direct_reads:
+            return task_mosaic_grouped_patches(
+                cloud_fs,
+                task,
+                method,
+                resolution,
+                read_resolution,
+                max_workers,
+            )
+
+        mosaic, transform = task_mosaic_array(
+            cloud_fs,
+            task,
+            method,
+            read_resolution,
+            max_workers,
+        )
+
+        return get_mosaic_patches(
+            mosaic,
+            task.tiles,
+            transform,
+            resolution,
+            task.band,
+        )
+
+    out_files = download_and_extract_tiles_window(
+        cloud_fs,
+        task,
+        resolution,
+        max_workers,
+    )
 
     out_f = f"{task.task_id}_{dst_path}"
     datasets = [rasterio.open(f) for f in out_files]
@@ -208,3 +897,203 @@ def task_mosaic_patches(
         os.remove(f)
     os.remove(out_f)
     return patches
+
+
+def task_mosaic_multiband_patches(
+    cloud_fs: Any,
+    task: MultiBandExtractionTask,
+    method: str = "max",
+    resolution: int = 10,
+    in_memory: bool = False,
+    max_workers: int = 1,
+    native_resolution: bool = False,
+    direct_reads: bool = False,
+) -> List[np.ndarray]:
+    """Get tile patches with all the bands of a multi band task.
+    The bands are extracted concurrently, at most max_workers assets are read at once.
+
+    Args:
+        cloud_fs (Any): the cloud_fs to access the files
+        task (MultiBandExtractionTask): The task
+        method (str, optional): The method to use while merging the assets. Defaults to "max".
+        resolution (int, optional): The target resolution. Defaults to 10.
+        in_memory (bool, optional): build the mosaics in memory instead of writing the
+            crops and the merged files to local disk. Defaults to False.
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
+        native_resolution (bool, optional): mosaic coarse bands at their gsd and only
+            upsample the tile patches. Defaults to False.
+        direct_reads (bool, optional): read the tiles overlapped by a single asset
+            directly from it. Defaults to False.
+
+    Returns:
+        List[np.ndarray]: The tile patches as (bands, height, width) numpy arrays
+    """
+    band_tasks = task.band_tasks()
+    # max_workers is split between the bands and the reads of each band, so the
+    # nested pools never read more than max_workers assets at once
+    n_workers = max(min(max_workers, len(band_tasks)), 1)
+    band_workers = max(max_workers // n_workers, 1)
+
+    def band_patches(band_task: ExtractionTask) -> List[np.ndarray]:
+        return task_mosaic_patches(
+            cloud_fs,
+            band_task,
+            method=method,
+            resolution=resolution,
+            in_memory=in_memory,
+            max_workers=band_workers,
+            native_resolution=native_resolution,
+            direct_reads=direct_reads,
+        )
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        bands_patches = list(executor.map(band_patches, band_tasks))
+
+    return [np.stack(tile_patches) for tile_patches in zip(*bands_patches)]
+
+
+def get_tile_blocks(
+    tiles: List[Tile],
+    resolution: int,
+    max_pixels: int,
+) -> List[List[Tile]]:
+    """Group the tiles in square spatial blocks, each one covering at most
+    max_pixels at the given resolution. A block holds at least one tile.
+
+    Args:
+        tiles (List[Tile]): the tiles, all in the same CRS
+        resolution (int): the target resolution
+        max_pixels (int): max number of pixels of a block grid
+
+    Returns:
+        List[List[Tile]]: the tiles of each block, blocks sorted by row and column
+    """
+    bounds = get_tiles_bounds(tiles)
+    tile_size = (bounds[:, 2:] - bounds[:, :2]).max()
+    tiles_per_side = int(math.sqrt(max_pixels) * resolution // tile_size)
+    if tiles_per_side < 1:
+        logger.warning(
+            f"A single {tile_size}m tile exceeds the block size of {max_pixels} pixels.",
+        )
+        tiles_per_side = 1
+
+    # tiles are on a regular grid, the rounding only absorbs float errors
+    cols = np.floor((bounds[:, 0] - bounds[:, 0].min()) / tile_size + 1e-6)
+    rows = np.floor((bounds[:, 3].max() - bounds[:, 3]) / tile_size + 1e-6)
+    block_cols = cols.astype(np.int64) // tiles_per_side
+    block_rows = rows.astype(np.int64) // tiles_per_side
+    keys = block_rows * (block_cols.max() + 1) + block_cols
+
+    order = np.argsort(keys, kind="stable")
+    splits = np.flatnonzero(np.diff(keys[order])) + 1
+    return [[tiles[i] for i in block] for block in np.split(order, splits)]
+
+
+def get_held_assets_bytes(
+    cloud_fs: Any,
+    task: Union[ExtractionTask, MultiBandExtractionTask],
+    max_workers: int = 1,
+) -> int:
+    """Get the bytes of the whole assets held in memory while extracting a task.
+    rasterio reads python file objects whole, so with the "fsspec" io engine every
+    asset being read, and every dataset kept open by the dataset cache, holds a
+    whole granule in memory. The "vsi" engine only reads the ranges it needs.
+
+    Args:
+        cloud_fs (Any): the cloud_fs to access the files
+        task (Union[ExtractionTask, MultiBandExtractionTask]): The task
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
+
+    Returns:
+        int: the approximate max bytes of whole assets held at once
+    """
+    if get_io_engine() == "vsi":
+        return 0
+
+    bands = task.bands if isinstance(task, MultiBandExtractionTask) else [task.band]
+    urls = [
+        item.assets[band].href for item in task.item_collection.items for band in bands
+    ]
+    if not urls:
+        return 0
+
+    n_workers = max(min(max_workers, len(urls)), 1)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        asset_bytes = max(executor.map(cloud_fs.size, urls))
+
+    dataset_cache = get_dataset_cache()
+    n_cached = 0 if dataset_cache is None else dataset_cache.maxsize
+    return int(asset_bytes) * (max_workers + n_cached)
+
+
+def task_mosaic_patch_blocks(
+    cloud_fs: Any,
+    task: Union[ExtractionTask, MultiBandExtractionTask],
+    memory_budget: int,
+    method: str = "max",
+    resolution: int = 10,
+    max_workers: int = 1,
+    native_resolution: bool = False,
+    direct_reads: bool = False,
+) -> Iterator[Tuple[List[Tile], List[np.ndarray]]]:
+    """Get the tile patches of a task block by block, so the memory used doesn't
+    grow with the task extent. The tiles are grouped in spatial blocks sized so the
+    in memory mosaics, the asset windows read ahead and the patches of the previous
+    block fit in memory_budget bytes, and each block only reads its own window.
+    With the "fsspec" io engine the whole assets being read and the ones kept by the
+    dataset cache are held in memory too, see get_held_assets_bytes, so they are
+    taken out of the budget first.
+
+    Args:
+        cloud_fs (Any): the cloud_fs to access the files
+        task (Union[ExtractionTask, MultiBandExtractionTask]): The task
+        memory_budget (int): approximate max bytes of raster data held at once
+        method (str, optional): The method to use while merging the assets. Defaults to "max".
+        resolution (int, optional): The target resolution. Defaults to 10.
+        max_workers (int, optional): max number of assets read concurrently. Defaults to 1.
+        native_resolution (bool, optional): mosaic coarse bands at their gsd and only
+            upsample the tile patches. Defaults to False.
+        direct_reads (bool, optional): read the tiles overlapped by a single asset
+            directly from it. Defaults to False.
+
+    Yields:
+        Iterator[Tuple[List[Tile], List[np.ndarray]]]: the tiles of each block and
+            their patches, in the same order
+    """
+    max_workers = max(max_workers, 1)
+    mosaic_patches: Callable[..., List[np.ndarray]]
+    if isinstance(task, MultiBandExtractionTask):
+        n_bands = len(task.bands)
+        # at most max_workers assets are read across the bands, every band mosaic is
+        # kept until the patches are stacked, plus the stacked patches of this and
+        # the previous block
+        n_buffers = max_workers + 3 * n_bands
+        mosaic_patches = task_mosaic_multiband_patches
+    else:
+        # the mosaic, the windows read ahead, the one being merged and the previous block
+        n_buffers = max_workers + 3
+        mosaic_patches = task_mosaic_patches
+
+    held_bytes = get_held_assets_bytes(cloud_fs, task, max_workers)
+    if held_bytes >= memory_budget:
+        logger.warning(
+            f"The {held_bytes} bytes of assets held in memory exceed the memory budget "
+            f"of {memory_budget} bytes, use the vsi io engine or a smaller dataset cache.",
+        )
+    buffers_budget = max(memory_budget - held_bytes, 0)
+    max_pixels = buffers_budget // (n_buffers * np.dtype(np.uint16).itemsize)
+    blocks = get_tile_blocks(task.tiles, resolution, max_pixels)
+    logger.info(f"Extracting {len(task.tiles)} tiles in {len(blocks)} blocks.")
+
+    for block_tiles in blocks:
+        patches = mosaic_patches(
+            cloud_fs,
+            attr.evolve(task, tiles=block_tiles),
+            method=method,
+            resolution=resolution,
+            in_memory=True,
+            max_workers=max_workers,
+            native_resolution=native_resolution,
+            direct_reads=direct_reads,
+        )
+        yield block_tiles, patches
@@ -0,0 +1,107 @@
+import contextlib
+import os
+from typing import Any
+from typing import Dict
+from typing import Iterator
+
+import rasterio
+from loguru import logger
+from satextractor.extractor.block_cache import open_file
+
+IO_ENGINES = ("fsspec", "vsi")
+
+_io_engine = "fsspec"
+_gdal_options: Dict[str, Any] = {}
+
+
+def get_gdal_options(
+    num_threads: str = "ALL_CPUS",
+    cache_max_mb: int = 256,
+    vsi_cache_mb: int = 64,
+    chunk_size_kb: int = 1024,
+) -> Dict[str, Any]:
+    """Get the GDAL config options used to read the assets.
+
+    Args:
+        num_threads (str, optional): threads used by the JP2OpenJPEG and GTiff drivers
+            to decode a read, a number or "ALL_CPUS". Defaults to "ALL_CPUS".
+        cache_max_mb (int, optional): size of the GDAL raster block cache. Defaults to 256.
+        vsi_cache_mb (int, optional): size of the VSI read cache per file. Defaults to 64.
+        chunk_size_kb (int, optional): size of the VSI http range requests. Defaults to 1024.
+
+    Returns:
+        Dict[str, Any]: the GDAL config options
+    """
+    return {
+        "GDAL_NUM_THREADS": num_threads,
+        "GDAL_CACHEMAX": cache_max_mb,
+        "VSI_CACHE": True,
+        "VSI_CACHE_SIZE": vsi_cache_mb * 1024 ** 2,
+        "CPL_VSIL_CURL_CHUNK_SIZE": chunk_size_kb * 1024,
+        "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".jp2,.tif,.TIF,.tiff",
+        "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+        "GDAL_HTTP_MULTIRANGE": "YES",
+        "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    }
+
+
+def configure_io_engine(engine: str = "fsspec", **gdal_options) -> Dict[str, Any]:
+    """Set up how the extractor opens the assets in this process.
+
+    "fsspec" reads through a python file object from the cloud_fs (and the disk
+    block cache if configured). "vsi" lets GDAL read the hrefs itself, e.g. gs:// urls
+    through /vsigs/, which supports multi range requests and GDAL's own caching.
+    The GDAL config options are used by both engines.
+
+    Args:
+        engine (str, optional): one of IO_ENGINES. Defaults to "fsspec".
+        gdal_options: the arguments of get_gdal_options
+
+    Returns:
+        Dict[str, Any]: the GDAL config options
+    """
+    global _io_engine, _gdal_options
+
+    if engine not in IO_ENGINES:
+        raise ValueError(f"Unknown io engine '{engine}', expected one of {IO_ENGINES}")
+
+    _io_engine = engine
+    _gdal_options = get_gdal_options(**gdal_options)
+    # GDAL sizes its block cache once, and openjpeg reads its default thread count
+    # from the process environment, so set them before the first asset is opened
+    os.environ.setdefault("GDAL_CACHEMAX", str(_gdal_options["GDAL_CACHEMAX"]))
+    os.environ.setdefault("OPJ_NUM_THREADS", str(_gdal_options["GDAL_NUM_THREADS"]))
+    logger.info(f"Reading assets with the {engine} io engine.")
+
+    return _gdal_options
+
+
+def get_io_engine() -> str:
+    return _io_engine
+
+
+def gdal_env() -> rasterio.Env:
+    """Get a rasterio.Env with the configured GDAL options. GDAL config options are
+    per thread, so the env has to be entered by the thread reading the assets.
+    """
+    return rasterio.Env(**_gdal_options)
+
+
+@contextlib.contextmanager
+def open_raster(fs: Any, href: str) -> Iterator[rasterio.io.DatasetReader]:
+    """Open an asset with the configured io engine.
+
+    Args:
+        fs (Any): the cloud_fs to access the files, unused by the "vsi" engine
+        href (str): the asset href
+
+    Yields:
+        Iterator[rasterio.io.DatasetReader]: the opened dataset
+    """
+    if _io_engine == "vsi":
+        with rasterio.open(href) as ds:
+            yield ds
+    else:
+        with open_file(fs, href) as f:
+            with rasterio.open(f) as ds:
+                yield ds
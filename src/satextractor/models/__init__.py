@@ -1,3 +1,7 @@
 from .constellation_info import BAND_INFO
+from .models import deserialize_task
 from .models import ExtractionTask
+from .models import MultiBandExtractionTask
+from .models import serialize_items
 from .models import Tile
+from .tileset import TileSet
@@ -1,3 +1,6 @@
+from typing import Any
+from typing import Dict
+
 from pystac import MediaType
 from pystac.extensions.eo import Band
 
@@ -396,7 +399,7 @@ SENTINEL2_BAND_INFO = {
     },
 }
 
-BAND_INFO = {
+BAND_INFO: Dict[str, Dict[str, Dict[str, Any]]] = {
     "sentinel-2": SENTINEL2_BAND_INFO,
     "landsat-5": LANDSAT5_BAND_INFO,
     "landsat-7": LANDSAT7_BAND_INFO,
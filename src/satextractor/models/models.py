@@ -1,8 +1,13 @@
 from __future__ import annotations
 
 import datetime
+from typing import Any
+from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import Optional
 from typing import Tuple
+from typing import Union
 
 import attr
 import pystac
@@ -85,9 +90,281 @@ class ExtractionTask:
     constellation: str = attr.ib()
     sensing_time: datetime.datetime = attr.ib()
 
-    def serialize(self):
+    def serialize(self, compact: bool = False) -> Dict[str, Any]:
+        """Serialize the task to a json serializable dict.
+
+        Args:
+            compact (bool, optional): reference the items by id instead of embedding
+                the item collection, and store the tiles by columns. The items are
+                serialized apart, with serialize_items. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: the serialized task
+        """
+        if compact:
+            return serialize_compact_task(self)
+        serialized_task = attr.asdict(self)
+        serialized_task["item_collection"] = serialized_task[
+            "item_collection"
+        ].to_dict()
+        return serialized_task
+
+
+@attr.s
+class MultiBandExtractionTask:
+    """Extraction task for several bands of the same items and tiles.
+    The bands are extracted and stored together by a single worker.
+
+    Args:
+        task_id (str): the task id
+        tiles (List[Tile]): the tiles to extract
+        item_collection (pystac.ItemCollection): the item collection with the assets
+        bands (List[str]): the bands to extract
+        constellation (str): the satellite constellation from which to extract
+        sensing_time (datetime.datetime): the assets starting sensing_time
+    """
+
+    task_id: str = attr.ib()
+    tiles: List[Tile] = attr.ib()
+    item_collection: pystac.ItemCollection = attr.ib()
+    bands: List[str] = attr.ib()
+    constellation: str = attr.ib()
+    sensing_time: datetime.datetime = attr.ib()
+
+    def band_tasks(self) -> List[ExtractionTask]:
+        return [
+            ExtractionTask(
+                task_id=f"{self.task_id}_{band}",
+                tiles=self.tiles,
+                item_collection=self.item_collection,
+                band=band,
+                constellation=self.constellation,
+                sensing_time=self.sensing_time,
+            )
+            for band in self.bands
+        ]
+
+    def serialize(self, compact: bool = False) -> Dict[str, Any]:
+        """Serialize the task to a json serializable dict.
+
+        Args:
+            compact (bool, optional): reference the items by id instead of embedding
+                the item collection, and store the tiles by columns. The items are
+                serialized apart, with serialize_items. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: the serialized task
+        """
+        if compact:
+            return serialize_compact_task(self)
         serialized_task = attr.asdict(self)
         serialized_task["item_collection"] = serialized_task[
             "item_collection"
         ].to_dict()
         return serialized_task
+
+
+TILE_FIELDS = [field.name for field in attr.fields(Tile)]
+
+# the tiles aligned to the grid of their size are stored by these fields and their
+# grid location, and their bounds are rebuilt from them
+GRID_FIELDS = ["zone", "row", "bbox_size_x", "bbox_size_y", "epsg"]
+
+
+def is_grid_aligned(tile: Tile) -> bool:
+    return (
+        tile.min_x == tile.xloc * tile.bbox_size_x
+        and tile.min_y == tile.yloc * tile.bbox_size_y
+        and tile.max_x == tile.min_x + tile.bbox_size_x
+        and tile.max_y == tile.min_y + tile.bbox_size_y
+    )
+
+
+def encode_runs(values: List[int]) -> List[Union[int, List[int]]]:
+    """Run length encode integers, each run of 3 or more values with a constant step
+    is stored as [start, step, count], the other values as they are.
+
+    Args:
+        values (List[int]): the values
+
+    Returns:
+        List[Union[int, List[int]]]: the runs and values
+    """
+    encoded: List[Union[int, List[int]]] = []
+    i = 0
+    while i < len(values):
+        # extend the run with the step of its first two values
+        j = i + 1
+        step = values[j] - values[i] if j < len(values) else 0
+        while j < len(values) and values[j] - values[j - 1] == step:
+            j += 1
+        if j - i >= 3:
+            encoded.append([values[i], step, j - i])
+            i = j
+        else:
+            encoded.append(values[i])
+            i += 1
+    return encoded
+
+
+def decode_runs(encoded: List[Union[int, List[int]]]) -> List[int]:
+    """Decode the integers run length encoded by encode_runs.
+
+    Args:
+        encoded (List[Union[int, List[int]]]): the runs and values
+
+    Returns:
+        List[int]: the values
+    """
+    values: List[int] = []
+    for run in encoded:
+        if isinstance(run, list):
+            start, step, count = run
+            values.extend(start + step * k for k in range(count))
+        else:
+            values.append(run)
+    return values
+
+
+def serialize_tiles(tiles: List[Tile]) -> Dict[str, Any]:
+    """Serialize tiles by columns. The tiles of a task are usually in the same UTM zone
+    and of the same size, so the columns with a single value are stored once. Tiles
+    aligned to the grid of their size, as the ones of the tiler, are stored by their
+    grid location instead of their bounds, run length encoded as the tiles of a task
+    are mostly contiguous.
+
+    Args:
+        tiles (List[Tile]): the tiles
+
+    Returns:
+        Dict[str, Any]: the values of the tiles by field, or their single value
+    """
+    serialized_tiles: Dict[str, Any] = {"n_tiles": len(tiles)}
+    if all(is_grid_aligned(tile) for tile in tiles):
+        fields = GRID_FIELDS
+        serialized_tiles["xloc"] = encode_runs([tile.xloc for tile in tiles])
+        serialized_tiles["yloc"] = encode_runs([tile.yloc for tile in tiles])
+    else:
+        fields = TILE_FIELDS
+
+    for field in fields:
+        values = [getattr(tile, field) for tile in tiles]
+        if len(set(values)) == 1:
+            serialized_tiles[field] = values[0]
+        else:
+            serialized_tiles[field] = values
+    return serialized_tiles
+
+
+def deserialize_tiles(
+    serialized_tiles: Union[Dict[str, Any], List[dict]],
+) -> List[Tile]:
+    """Deserialize tiles stored by columns or grid location, or as a list of dicts.
+
+    Args:
+        serialized_tiles (Union[Dict[str, Any], List[dict]]): the serialized tiles
+
+    Returns:
+        List[Tile]: the tiles
+    """
+    if isinstance(serialized_tiles, list):
+        return [Tile(**tile) for tile in serialized_tiles]
+
+    n_tiles = serialized_tiles["n_tiles"]
+    fields = GRID_FIELDS if "xloc" in serialized_tiles else TILE_FIELDS
+    columns = []
+    for field in fields:
+        values = serialized_tiles[field]
+        columns.append(values if isinstance(values, list) else [values] * n_tiles)
+
+    if "xloc" not in serialized_tiles:
+        return [Tile(*values) for values in zip(*columns)]
+
+    xlocs = decode_runs(serialized_tiles["xloc"])
+    ylocs = decode_runs(serialized_tiles["yloc"])
+    return [
+        Tile(
+            zone=zone,
+            row=row,
+            min_x=xloc * size_x,
+            min_y=yloc * size_y,
+            max_x=(xloc + 1) * size_x,
+            max_y=(yloc + 1) * size_y,
+            epsg=epsg,
+        )
+        for zone, row, size_x, size_y, epsg, xloc, yloc in zip(*columns, xlocs, ylocs)
+    ]
+
+
+def serialize_compact_task(
+    task: Union[ExtractionTask, MultiBandExtractionTask],
+) -> Dict[str, Any]:
+    serialized_task = attr.asdict(
+        task,
+        recurse=False,
+        filter=lambda a, _: a.name not in ("tiles", "item_collection"),
+    )
+    serialized_task["tiles"] = serialize_tiles(task.tiles)
+    serialized_task["item_ids"] = [item.id for item in task.item_collection.items]
+    return serialized_task
+
+
+def serialize_items(
+    tasks: Iterable[Union[ExtractionTask, MultiBandExtractionTask]],
+) -> Dict[str, dict]:
+    """Serialize the items of compact tasks in a table shared by the tasks,
+    each item is serialized once.
+
+    Args:
+        tasks (Iterable[Union[ExtractionTask, MultiBandExtractionTask]]): the tasks
+
+    Returns:
+        Dict[str, dict]: the serialized items by id
+    """
+    items = {}
+    for task in tasks:
+        for item in task.item_collection.items:
+            if item.id not in items:
+                items[item.id] = item.to_dict()
+    return items
+
+
+def deserialize_task(
+    serialized_task: Dict[str, Any],
+    items: Optional[Dict[str, dict]] = None,
+) -> Union[ExtractionTask, MultiBandExtractionTask]:
+    """Deserialize a task, resolving the items of compact tasks in the items table.
+
+    Args:
+        serialized_task (Dict[str, Any]): the serialized task, compact or not
+        items (Optional[Dict[str, dict]], optional): the serialized items by id, for
+            compact tasks. Defaults to None.
+
+    Returns:
+        Union[ExtractionTask, MultiBandExtractionTask]: the task
+    """
+    if "item_collection" in serialized_task:
+        item_collection = pystac.ItemCollection.from_dict(
+            serialized_task["item_collection"],
+        )
+    else:
+        if items is None:
+            raise ValueError("The items table is needed to deserialize compact tasks.")
+        item_collection = pystac.ItemCollection(
+            [pystac.Item.from_dict(items[i]) for i in serialized_task["item_ids"]],
+        )
+
+    sensing_time = serialized_task["sensing_time"]
+    if isinstance(sensing_time, str):
+        sensing_time = datetime.datetime.fromisoformat(sensing_time)
+
+    common = dict(
+        task_id=serialized_task["task_id"],
+        tiles=deserialize_tiles(serialized_task["tiles"]),
+        item_collection=item_collection,
+        constellation=serialized_task["constellation"],
+        sensing_time=sensing_time,
+    )
+    if "bands" in serialized_task:
+        return MultiBandExtractionTask(bands=serialized_task["bands"], **common)
+    return ExtractionTask(band=serialized_task["band"], **common)
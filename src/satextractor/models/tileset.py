@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+from typing import overload
+from typing import Sequence
+from typing import Union
+
+import attr
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from satextractor.models.models import Tile
+from satextractor.models.models import TILE_FIELDS
+from satextractor.utils import get_transform_function
+
+
+@attr.s(frozen=True, eq=False)
+class TileSet(Sequence[Tile]):
+    """Columnar set of tiles, each field of the tiles is stored in a numpy array.
+    The ids, bounds and WGS84 bounds are computed for all the tiles at once, slicing
+    returns a TileSet of views of the columns, and indexing and iterating yield
+    Tile objects. A TileSet is a Sequence[Tile], so it can be used where a sequence
+    of tiles is expected.
+
+    Args:
+        zone (np.ndarray): the UTM zone of the tiles
+        row (np.ndarray): the UTM row of the tiles
+        min_x (np.ndarray): the min x of the tiles, in the tile crs
+        min_y (np.ndarray): the min y of the tiles, in the tile crs
+        max_x (np.ndarray): the max x of the tiles, in the tile crs
+        max_y (np.ndarray): the max y of the tiles, in the tile crs
+        epsg (np.ndarray): the epsg code of the crs of the tiles
+    """
+
+    zone: np.ndarray = attr.ib(converter=np.asarray)
+    row: np.ndarray = attr.ib(converter=np.asarray)
+    min_x: np.ndarray = attr.ib(converter=np.asarray)
+    min_y: np.ndarray = attr.ib(converter=np.asarray)
+    max_x: np.ndarray = attr.ib(converter=np.asarray)
+    max_y: np.ndarray = attr.ib(converter=np.asarray)
+    epsg: np.ndarray = attr.ib(converter=np.asarray)
+
+    def __attrs_post_init__(self):
+        lengths = {len(column) for column in self.columns}
+        if len(lengths) > 1:
+            raise ValueError(f"The TileSet columns have different lengths: {lengths}")
+
+    @classmethod
+    def from_tiles(cls, tiles: Iterable[Tile]) -> TileSet:
+        if isinstance(tiles, TileSet):
+            return tiles
+        tiles = list(tiles)
+        return cls(*[[getattr(tile, field) for tile in tiles] for field in TILE_FIELDS])
+
+    @property
+    def columns(self):
+        return [getattr(self, field) for field in TILE_FIELDS]
+
+    def __len__(self) -> int:
+        return len(self.zone)
+
+    def __iter__(self) -> Iterator[Tile]:
+        for values in zip(*[column.tolist() for column in self.columns]):
+            yield Tile(*values)
+
+    @overload
+    def __getitem__(self, key: Union[int, np.integer]) -> Tile:
+        ...
+
+    @overload
+    def __getitem__(self, key: Union[slice, np.ndarray, Sequence[int]]) -> TileSet:
+        ...
+
+    def __getitem__(self, key: Any) -> Union[Tile, TileSet]:
+        if isinstance(key, (int, np.integer)):
+            return Tile(*[column[[key]].tolist()[0] for column in self.columns])
+        return TileSet(*[column[key] for column in self.columns])
+
+    @property
+    def id(self) -> np.ndarray:
+        return np.array(
+            [
+                f"{zone}_{row}_{size_x}_{xloc}_{yloc}"
+                for zone, row, size_x, xloc, yloc in zip(
+                    self.zone.tolist(),
+                    self.row.tolist(),
+                    self.bbox_size_x.tolist(),
+                    self.xloc.tolist(),
+                    self.yloc.tolist(),
+                )
+            ],
+            dtype=str,
+        )
+
+    @property
+    def xloc(self) -> np.ndarray:
+        return (self.min_x / self.bbox_size_x).astype(int)
+
+    @property
+    def yloc(self) -> np.ndarray:
+        return (self.min_y / self.bbox_size_y).astype(int)
+
+    @property
+    def bbox(self) -> np.ndarray:
+        bbox = np.stack([self.min_x, self.min_y, self.max_x, self.max_y], axis=1)
+        return bbox.astype(float).reshape(-1, 4)
+
+    @property
+    def bbox_wgs84(self) -> np.ndarray:
+        # a single transform per epsg, for all its tiles at once
+        bbox = self.bbox
+        epsgs = self.epsg.astype(str)
+
+        bbox_wgs84 = np.empty_like(bbox)
+        for epsg in np.unique(epsgs):
+            sel = epsgs == epsg
+            reproj_src_wgs = get_transform_function(epsg, "WGS84")
+            bbox_wgs84[sel, 0], bbox_wgs84[sel, 1] = reproj_src_wgs(
+                bbox[sel, 0],
+                bbox[sel, 1],
+            )
+            bbox_wgs84[sel, 2], bbox_wgs84[sel, 3] = reproj_src_wgs(
+                bbox[sel, 2],
+                bbox[sel, 3],
+            )
+
+        return bbox_wgs84
+
+    @property
+    def bbox_size_x(self) -> np.ndarray:  # in metres
+        return (self.max_x - self.min_x).astype(int)
+
+    @property
+    def bbox_size_y(self) -> np.ndarray:  # in metres
+        return (self.max_y - self.min_y).astype(int)
+
+    @property
+    def bbox_size(self) -> np.ndarray:  # in metres
+        return np.stack([self.bbox_size_x, self.bbox_size_y], axis=1).reshape(-1, 2)
+
+    def to_arrow(self) -> pa.Table:
+        return pa.table({field: getattr(self, field) for field in TILE_FIELDS})
+
+    @classmethod
+    def from_arrow(cls, table: pa.Table) -> TileSet:
+        return cls(*[table.column(field).to_numpy() for field in TILE_FIELDS])
+
+    def to_parquet(self, path: str, **kwargs):
+        """Write the tiles to a parquet file.
+
+        Args:
+            path (str): the file path
+            **kwargs: the arguments of pyarrow.parquet.write_table, e.g. filesystem
+        """
+        pq.write_table(self.to_arrow(), path, **kwargs)
+
+    @classmethod
+    def read_parquet(cls, path: str, **kwargs) -> TileSet:
+        """Read the tiles from a parquet file.
+
+        Args:
+            path (str): the file path
+            **kwargs: the arguments of pyarrow.parquet.read_table, e.g. filesystem
+
+        Returns:
+            TileSet: the tiles
+        """
+        return cls.from_arrow(pq.read_table(path, columns=TILE_FIELDS, **kwargs))
@@ -0,0 +1,286 @@
+import datetime
+import json
+from collections import defaultdict
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import pystac
+import shapely.geometry
+from satextractor.models import ExtractionTask
+from satextractor.models import MultiBandExtractionTask
+from satextractor.models import Tile
+from satextractor.models.constellation_info import BAND_INFO
+from satextractor.preparer import build_zarr_tile_structure
+from satextractor.utils import get_transform_function
+
+MB = 1024 ** 2
+
+COUNT_COLUMNS = [
+    "tasks",
+    "tiles",
+    "timestamps",
+    "patches",
+    "chunks",
+    "metadata_ops",
+    "puts",
+    "messages",
+]
+
+
+def get_archive_objects(
+    constellation: Optional[str],
+    patch_size: int,
+    chunk_size: int,
+    band_chunk: int = 1,
+    compressor: Optional[Dict[str, Any]] = None,
+    consolidated: bool = False,
+) -> int:
+    """Get the number of metadata objects the preparer creates for the archive of a
+    tile, by building one in memory.
+
+    Args:
+        constellation (Optional[str]): the constellation of the archive, None for the
+            tile root only
+        patch_size (int): the tile size in meters
+        chunk_size (int): the data chunk size in pixels
+        band_chunk (int, optional): bands per data chunk. Defaults to 1.
+        compressor (Optional[Dict[str, Any]], optional): the numcodecs compressor
+            config. Defaults to the zarr default.
+        consolidated (bool, optional): the tile metadata is consolidated.
+            Defaults to False.
+
+    Returns:
+        int: the number of objects
+    """
+    constellations_sensing_times = {}
+    if constellation is not None:
+        sensing_times = np.array([np.datetime64(datetime.datetime(2020, 1, 1))])
+        constellations_sensing_times[constellation] = sensing_times
+
+    objects = build_zarr_tile_structure(
+        "plan",
+        "tile",
+        patch_size,
+        chunk_size,
+        constellations_sensing_times,
+        band_chunk,
+        compressor,
+        consolidated,
+    )
+    return len(objects)
+
+
+def get_task_message_bytes(
+    tasks: List[Union[ExtractionTask, MultiBandExtractionTask]],
+    n_samples: int = 100,
+    compact: bool = False,
+) -> float:
+    """Get the mean size of the deployer message of a task, from a sample of the tasks.
+
+    Args:
+        tasks (List[Union[ExtractionTask, MultiBandExtractionTask]]): the tasks
+        n_samples (int, optional): max number of tasks serialized. Defaults to 100.
+        compact (bool, optional): the deployer sends compact tasks. Defaults to False.
+
+    Returns:
+        float: the mean message size in bytes
+    """
+    if not tasks:
+        return 0.0
+    step = max(len(tasks) // n_samples, 1)
+    sizes = [
+        len(json.dumps(task.serialize(compact), default=str)) for task in tasks[::step]
+    ]
+    return float(np.mean(sizes))
+
+
+def get_asset_pixels(item: pystac.Item, band: str, gsd: float, epsg: str) -> float:
+    """Get the number of pixels of the asset of a band, from its proj:shape if the
+    item has the projection extension, else from the item bbox in the tiles crs.
+
+    Args:
+        item (pystac.Item): the item
+        band (str): the band asset key
+        gsd (float): the band ground sample distance
+        epsg (str): the epsg code of the tiles crs
+
+    Returns:
+        float: the number of pixels of the asset
+    """
+    asset = item.assets.get(band)
+    shape = asset.extra_fields.get("proj:shape") if asset is not None else None
+    if shape is not None:
+        return float(np.prod(shape))
+
+    bbox = item.bbox or shapely.geometry.shape(item.geometry).bounds
+    min_lon, min_lat, max_lon, max_lat = bbox
+    reproj_wgs_dst = get_transform_function("WGS84", epsg)
+    xs, ys = reproj_wgs_dst(
+        [min_lon, min_lon, max_lon, max_lon],
+        [min_lat, max_lat, min_lat, max_lat],
+    )
+    return (max(xs) - min(xs)) * (max(ys) - min(ys)) / gsd ** 2
+
+
+def plan_extraction(
+    tiles: Sequence[Tile],
+    extraction_tasks: List[Union[ExtractionTask, MultiBandExtractionTask]],
+    constellations: List[str],
+    patch_size: int,
+    chunk_size: int,
+    band_chunk: int = 1,
+    compressor: Optional[Dict[str, Any]] = None,
+    consolidated: bool = False,
+    compression_ratio: float = 2.0,
+    input_compression_ratio: float = 3.0,
+    store_ops_per_patch: int = 5,
+    worker_seconds_per_task: float = 2.0,
+    worker_seconds_per_mpixel: float = 0.5,
+    n_samples: int = 100,
+    compact: bool = False,
+    io_engine: str = "fsspec",
+    **kwargs,
+) -> pd.DataFrame:
+    """Estimate the size and cost of an extraction before preparing and deploying it,
+    per constellation. It runs offline, from the tiles and the extraction tasks only.
+
+    The archive size assumes every patch has data, chunks of nodata are not stored so
+    actual archives are smaller. With the "fsspec" io engine the workers read the
+    whole assets of every task, with "vsi" only the windows of the tiles, so the input
+    bytes are estimated from the assets sizes or from the tiles windows, without the
+    worker caches. The coefficients can be measured with the benchmarks.
+
+    Args:
+        tiles (Sequence[Tile]): the tiles
+        extraction_tasks (List[Union[ExtractionTask, MultiBandExtractionTask]]): the tasks
+        constellations (List[str]): the constellations
+        patch_size (int): the tile size in meters
+        chunk_size (int): the data chunk size in pixels
+        band_chunk (int, optional): bands per data chunk. Defaults to 1.
+        compressor (Optional[Dict[str, Any]], optional): the numcodecs compressor
+            config. Defaults to the zarr default.
+        consolidated (bool, optional): the tile metadata is consolidated.
+            Defaults to False.
+        compression_ratio (float, optional): compression ratio of the archive data.
+            Defaults to 2.0.
+        input_compression_ratio (float, optional): compression ratio of the assets.
+            Defaults to 3.0.
+        store_ops_per_patch (int, optional): metadata reads and writes of the storer
+            per stored patch. Defaults to 5.
+        worker_seconds_per_task (float, optional): fixed worker time per task.
+            Defaults to 2.0.
+        worker_seconds_per_mpixel (float, optional): worker time to read, mosaic and
+            store a megapixel of a band. Defaults to 0.5.
+        n_samples (int, optional): tasks serialized to measure the message size.
+            Defaults to 100.
+        compact (bool, optional): the deployer sends compact tasks, and uploads their
+            items once. Defaults to False.
+        io_engine (str, optional): the io engine of the workers, "fsspec" or "vsi".
+            Defaults to "fsspec".
+
+    Returns:
+        pd.DataFrame: the estimates per constellation, and their total
+    """
+    archive_args = (
+        patch_size,
+        chunk_size,
+        band_chunk,
+        compressor,
+        consolidated,
+    )
+    tile_objects = get_archive_objects(None, *archive_args)
+
+    tasks_by_constellation = defaultdict(list)
+    for task in extraction_tasks:
+        tasks_by_constellation[task.constellation].append(task)
+
+    asset_pixels: Dict[Tuple[str, str], float] = {}
+
+    rows = []
+    for constellation in constellations:
+        tasks = tasks_by_constellation[constellation]
+        bands = BAND_INFO[constellation]
+        n_bands = len(bands)
+        archive_px = int(patch_size // min(b["gsd"] for b in bands.values()))
+
+        # the archive rows of each tile are the unique sensing times of its tasks
+        tile_sensing_times = defaultdict(set)
+        n_patches = 0
+        input_pixels = 0.0
+        item_ids: Set[str] = set()
+        for task in tasks:
+            task_bands = (
+                task.bands if isinstance(task, MultiBandExtractionTask) else [task.band]
+            )
+            for tile in task.tiles:
+                tile_sensing_times[tile.id].add(task.sensing_time)
+            n_patches += len(task.tiles) * len(task_bands)
+            n_items = len(task.item_collection.items)
+            item_ids.update(item.id for item in task.item_collection.items)
+            for band in task_bands:
+                gsd = bands[band.upper()]["gsd"]
+                if io_engine == "vsi":
+                    input_pixels += n_items * len(task.tiles) * (patch_size / gsd) ** 2
+                    continue
+                for item in task.item_collection.items:
+                    key = (item.id, band)
+                    if key not in asset_pixels:
+                        asset_pixels[key] = get_asset_pixels(
+                            item,
+                            band,
+                            gsd,
+                            task.tiles[0].epsg,
+                        )
+                    input_pixels += asset_pixels[key]
+
+        n_tiles = len(tile_sensing_times)
+        n_timestamps = np.array([len(v) for v in tile_sensing_times.values()], int)
+
+        n_spatial_chunks = int(np.ceil(archive_px / chunk_size)) ** 2
+        # data chunks hold a single timestamp
+        n_chunks = int(
+            n_timestamps.sum() * np.ceil(n_bands / band_chunk) * n_spatial_chunks,
+        )
+        archive_bytes = int(n_timestamps.sum()) * n_bands * archive_px ** 2 * 2
+
+        n_objects = n_tiles * (
+            get_archive_objects(constellation, *archive_args) - tile_objects
+        )
+        message_bytes = get_task_message_bytes(tasks, n_samples, compact)
+        n_item_objects = len(item_ids) if compact else 0
+        output_mpixels = n_patches * archive_px ** 2 / 1e6
+
+        rows.append(
+            {
+                "constellation": constellation,
+                "tasks": len(tasks),
+                "tiles": n_tiles,
+                "timestamps": int(n_timestamps.sum()),
+                "patches": n_patches,
+                "archive_mb": archive_bytes / compression_ratio / MB,
+                "chunks": n_chunks,
+                "metadata_ops": n_objects + n_patches * store_ops_per_patch,
+                "puts": n_objects + n_chunks + n_item_objects,
+                "input_mb": input_pixels * 2 / input_compression_ratio / MB,
+                "messages": len(tasks),
+                "message_mb": len(tasks) * message_bytes / MB,
+                "worker_seconds": len(tasks) * worker_seconds_per_task
+                + output_mpixels * worker_seconds_per_mpixel,
+            },
+        )
+
+    plan = pd.DataFrame(rows).set_index("constellation")
+    plan.loc["total"] = plan.sum()
+    # every tile gets an archive root, with or without tasks
+    plan.loc["total", "tiles"] = len(tiles)
+    plan.loc["total", "metadata_ops"] += len(tiles) * tile_objects
+    plan.loc["total", "puts"] += len(tiles) * tile_objects
+    return plan.astype({column: int for column in COUNT_COLUMNS})
@@ -1 +1,2 @@
+from .preparer import build_zarr_tile_structure
 from .preparer import create_zarr_patch_structure
@@ -0,0 +1,111 @@
+import asyncio
+import random
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+from fsspec.asyn import sync
+from loguru import logger
+from tqdm import tqdm
+
+# errors that retrying the same request will not fix
+NON_RETRIABLE_ERRORS = (FileNotFoundError, PermissionError, ValueError, TypeError)
+
+
+async def put_object_async(
+    fs: Any,
+    path: str,
+    value: bytes,
+    retries: int = 5,
+    backoff: float = 0.5,
+    max_backoff: float = 32,
+):
+    """Write an object, retrying failed requests with exponential backoff and jitter.
+
+    Args:
+        fs (Any): the fsspec file system, e.g. a GCSFileSystem
+        path (str): the object path
+        value (bytes): the object content
+        retries (int, optional): max number of retries. Defaults to 5.
+        backoff (float, optional): delay before the first retry, in seconds,
+            doubled on every retry. Defaults to 0.5.
+        max_backoff (float, optional): max delay between retries. Defaults to 32.
+    """
+    for attempt in range(retries + 1):
+        try:
+            if fs.async_impl:
+                await fs._pipe_file(path, value)
+            else:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, fs.pipe_file, path, value)
+            return
+        except NON_RETRIABLE_ERRORS:
+            raise
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = min(backoff * 2**attempt, max_backoff) * random.uniform(0.5, 1.5)
+            logger.debug(f"Retrying {path} in {delay:.1f}s after: {e!r}")
+            await asyncio.sleep(delay)
+
+
+async def put_objects_async(
+    fs: Any,
+    objects: Dict[str, bytes],
+    max_in_flight: int = 256,
+    retries: int = 5,
+    backoff: float = 0.5,
+    pbar: Optional[tqdm] = None,
+) -> int:
+    """Write many objects concurrently, with at most max_in_flight requests at a time.
+
+    Args:
+        fs (Any): the fsspec file system, e.g. a GCSFileSystem
+        objects (Dict[str, bytes]): the content of the objects, by path
+        max_in_flight (int, optional): max number of concurrent requests. Defaults to 256.
+        retries (int, optional): max number of retries per object. Defaults to 5.
+        backoff (float, optional): delay before the first retry, in seconds. Defaults to 0.5.
+        pbar (Optional[tqdm], optional): progress bar updated per object. Defaults to None.
+
+    Returns:
+        int: the number of objects written
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def put(path: str, value: bytes):
+        async with semaphore:
+            await put_object_async(fs, path, value, retries, backoff)
+        if pbar is not None:
+            pbar.update(1)
+
+    # a task per object, the semaphore bounds the requests in flight, not the tasks
+    await asyncio.gather(*[put(path, value) for path, value in objects.items()])
+    return len(objects)
+
+
+def put_objects(
+    fs: Any,
+    objects: Dict[str, bytes],
+    max_in_flight: int = 256,
+    retries: int = 5,
+    backoff: float = 0.5,
+    pbar: Optional[tqdm] = None,
+) -> int:
+    """Write many objects concurrently from synchronous code.
+    Async file systems run the requests on their own event loop, others on threads.
+
+    Args:
+        fs (Any): the fsspec file system, e.g. a GCSFileSystem
+        objects (Dict[str, bytes]): the content of the objects, by path
+        max_in_flight (int, optional): max number of concurrent requests. Defaults to 256.
+        retries (int, optional): max number of retries per object. Defaults to 5.
+        backoff (float, optional): delay before the first retry, in seconds. Defaults to 0.5.
+        pbar (Optional[tqdm], optional): progress bar updated per object. Defaults to None.
+
+    Returns:
+        int: the number of objects written
+    """
+    args = (fs, objects, max_in_flight, retries, backoff, pbar)
+    if fs.async_impl:
+        return sync(fs.loop, put_objects_async, *args)
+    return asyncio.run(put_objects_async(*args))
@@ -1,6 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any
 from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Union
 
 import numpy as np
 import zarr
@@ -8,18 +14,27 @@ from gcsfs import GCSFileSystem
 from joblib import delayed
 from joblib import Parallel
 from loguru import logger
+from satextractor.archive import ARCHIVE_FORMAT_VERSION
+from satextractor.archive import migrate_archive_timestamps
+from satextractor.archive import update_consolidated_metadata
 from satextractor.models import ExtractionTask
+from satextractor.models import MultiBandExtractionTask
 from satextractor.models import Tile
 from satextractor.models.constellation_info import BAND_INFO
+from satextractor.preparer import build_zarr_tile_structure
 from satextractor.preparer import create_zarr_patch_structure
+from satextractor.preparer.async_engine import put_objects
 from satextractor.utils import tqdm_joblib
 from tqdm import tqdm
+from zarr.errors import ArrayNotFoundError
+from zarr.errors import GroupNotFoundError
+from zarr.errors import PathNotFoundError
 
 
 def gcp_prepare_archive(
     credentials: str,
-    tasks: List[ExtractionTask],
-    tiles: List[Tile],
+    tasks: List[Union[ExtractionTask, MultiBandExtractionTask]],
+    tiles: Sequence[Tile],
     constellations: List[str],
     storage_root: str,
     patch_size: int,
@@ -27,9 +42,62 @@ def gcp_prepare_archive(
     chunk_size: int,
     n_jobs: int = -1,
     verbose: int = 0,
+    band_chunk: int = 1,
+    compressor: Optional[Dict[str, Any]] = None,
+    bulk: bool = False,
+    consolidated: bool = False,
+    bulk_batch_size: int = 1000,
+    max_in_flight: int = 256,
+    retries: int = 5,
+    backoff: float = 0.5,
     **kwargs,
 ) -> bool:
+    """Prepare the archives of the tiles for the extraction tasks.
+
+    Existing archives are updated one zarr call at a time. With `bulk`, the archives
+    of the tiles not in the storage yet are built in memory and uploaded in batches
+    of concurrent requests, which is much faster for new datasets.
+
+    Args:
+        credentials (str): the gcp credentials
+        tasks (List[Union[ExtractionTask, MultiBandExtractionTask]]): the tasks
+        tiles (Sequence[Tile]): the tiles
+        constellations (List[str]): the constellations
+        storage_root (str): the archive root path
+        patch_size (int): the tile size in meters
+        overwrite (bool): overwrite the existing archives
+        chunk_size (int): the data chunk size in pixels
+        n_jobs (int, optional): number of concurrent jobs. Defaults to -1.
+        verbose (int, optional): joblib verbosity. Defaults to 0.
+        band_chunk (int, optional): bands per data chunk, more than 1 only with
+            multiband tasks. Defaults to 1.
+        compressor (Optional[Dict[str, Any]], optional): the numcodecs compressor
+            config. Defaults to the zarr default.
+        bulk (bool, optional): build the new archives in bulk. Defaults to False.
+        consolidated (bool, optional): consolidate the metadata of the tile archives.
+            Defaults to False.
+        bulk_batch_size (int, optional): tiles uploaded per batch. Defaults to 1000.
+        max_in_flight (int, optional): max number of concurrent requests of the bulk
+            uploads. Defaults to 256.
+        retries (int, optional): max number of retries per object of the bulk uploads.
+            Defaults to 5.
+        backoff (float, optional): delay before the first retry, in seconds, doubled on
+            every retry. Defaults to 0.5.
+
+    Returns:
+        bool: True once the archives are prepared
+    """
+    if band_chunk > 1 and not all(
+        isinstance(task, MultiBandExtractionTask) for task in tasks
+    ):
+        # single band tasks of the same chunk would run concurrently, each one reading
+        # and rewriting the chunk, so the last writer would drop the other bands
+        raise ValueError(
+            f"Data chunks spanning {band_chunk} bands need multiband extraction tasks.",
+        )
+
     fs = GCSFileSystem(token=credentials)
+
     # make a dict of tiles and constellations sensing times
     tile_constellation_sensing_times: Dict[str, Dict[str, List[datetime]]] = {
         tt.id: {kk: [] for kk in BAND_INFO.keys() if kk in constellations}
@@ -41,7 +109,7 @@ def gcp_prepare_archive(
         # check tiles meet spec
         assert isinstance(
             task,
-            ExtractionTask,
+            (ExtractionTask, MultiBandExtractionTask),
         ), "Task does not match ExtractionTask spec"
 
         for tile in task.tiles:
@@ -61,7 +129,37 @@ def gcp_prepare_archive(
                 ],
             )
 
-    items = tile_constellation_sensing_times.items()
+    items = list(tile_constellation_sensing_times.items())
+
+    if bulk:
+        existing_tiles = get_existing_tiles(fs, storage_root)
+        new_items = [
+            (tile_id, vv) for tile_id, vv in items if tile_id not in existing_tiles
+        ]
+        items = [(tile_id, vv) for tile_id, vv in items if tile_id in existing_tiles]
+        logger.info(
+            f"{len(new_items)} new tile archives built in bulk, "
+            f"{len(items)} existing ones updated",
+        )
+        gcp_bulk_build_archives(
+            fs,
+            new_items,
+            storage_root,
+            patch_size,
+            chunk_size,
+            n_jobs,
+            band_chunk,
+            compressor,
+            consolidated,
+            bulk_batch_size,
+            max_in_flight,
+            retries,
+            backoff,
+        )
+
+    if not items:
+        return True
+
     with tqdm_joblib(
         tqdm(
             desc=f"parallel building zarr tile roots on {storage_root}",
@@ -90,12 +188,198 @@ def gcp_prepare_archive(
                     constellation,
                     BAND_INFO[constellation],
                     overwrite,
+                    band_chunk,
+                    compressor,
                 ),
             )
 
-    with tqdm_joblib(
-        tqdm(desc="Building Archives.", total=len(tiles) * len(constellations)),
-    ):
+    with tqdm_joblib(tqdm(desc="Building Archives.", total=len(jobs))):
         Parallel(n_jobs=n_jobs, verbose=verbose, prefer="threads")(jobs)
 
+    # archives consolidated by a previous run would hide the changes to their readers
+    with tqdm_joblib(tqdm(desc="Consolidating metadata.", total=len(items))):
+        Parallel(n_jobs=n_jobs, verbose=verbose, prefer="threads")(
+            [
+                delayed(update_consolidated_metadata)(
+                    fs.get_mapper,
+                    f"{storage_root}/{tile_id}",
+                    consolidated,
+                )
+                for tile_id, _ in items
+            ],
+        )
+
     return True
+
+
+def get_existing_tiles(fs: GCSFileSystem, storage_root: str) -> Set[str]:
+    """Get the ids of the tiles archived in the storage root, with a single listing.
+
+    Args:
+        fs (GCSFileSystem): the gcs file system
+        storage_root (str): the archive root path
+
+    Returns:
+        Set[str]: the tile ids
+    """
+    try:
+        paths = fs.ls(storage_root, detail=False)
+    except FileNotFoundError:
+        return set()
+    return {path.rstrip("/").rsplit("/", 1)[-1] for path in paths}
+
+
+def gcp_bulk_build_archives(
+    fs: GCSFileSystem,
+    items: List[Any],
+    storage_root: str,
+    patch_size: int,
+    chunk_size: int,
+    n_jobs: int = -1,
+    band_chunk: int = 1,
+    compressor: Optional[Dict[str, Any]] = None,
+    consolidated: bool = True,
+    batch_size: int = 1000,
+    max_in_flight: int = 256,
+    retries: int = 5,
+    backoff: float = 0.5,
+):
+    """Build the archives of new tiles in memory, and upload each batch of tiles with
+    the async engine instead of one zarr call per object. A batch is uploaded while
+    the next one is built.
+
+    Args:
+        fs (GCSFileSystem): the gcs file system
+        items (List[Any]): the (tile id, constellations sensing times) of the new tiles
+        storage_root (str): the archive root path
+        patch_size (int): the tile size in meters
+        chunk_size (int): the data chunk size in pixels
+        n_jobs (int, optional): number of threads building archives. Defaults to -1.
+        band_chunk (int, optional): bands per data chunk. Defaults to 1.
+        compressor (Optional[Dict[str, Any]], optional): the numcodecs compressor
+            config. Defaults to the zarr default.
+        consolidated (bool, optional): consolidate the metadata of the tile archives.
+            Defaults to True.
+        batch_size (int, optional): tiles uploaded per batch. Defaults to 1000.
+        max_in_flight (int, optional): max number of concurrent requests. Defaults to 256.
+        retries (int, optional): max number of retries per object. Defaults to 5.
+        backoff (float, optional): delay before the first retry, in seconds. Defaults to 0.5.
+    """
+    upload = None
+    # a tile is built in a few ms, much faster than it is uploaded, so threads keep
+    # up with the uploads without spawning n_jobs processes
+    with Parallel(n_jobs=n_jobs, prefer="threads") as parallel, ThreadPoolExecutor(
+        max_workers=1,
+    ) as executor, tqdm(
+        desc=f"Uploading archives in bulk to {storage_root}",
+        unit="objects",
+    ) as pbar:
+        for start in tqdm(
+            range(0, len(items), batch_size),
+            desc="Building archives in bulk",
+            unit="batches",
+        ):
+            batch = items[start : start + batch_size]
+            structures = parallel(
+                delayed(build_zarr_tile_structure)(
+                    storage_root,
+                    tile_id,
+                    patch_size,
+                    chunk_size,
+                    constellations_sensing_times,
+                    band_chunk,
+                    compressor,
+                    consolidated,
+                )
+                for tile_id, constellations_sensing_times in batch
+            )
+            objects = {
+                path: value
+                for structure in structures
+                for path, value in structure.items()
+            }
+            if upload is not None:
+                upload.result()
+            pbar.total = (pbar.total or 0) + len(objects)
+            upload = executor.submit(
+                put_objects,
+                fs,
+                objects,
+                max_in_flight,
+                retries,
+                backoff,
+                pbar,
+            )
+
+        if upload is not None:
+            upload.result()
+
+
+def gcp_migrate_archive(
+    credentials: str,
+    tiles: Sequence[Tile],
+    constellations: List[str],
+    storage_root: str,
+    n_jobs: int = -1,
+    verbose: int = 0,
+    **kwargs,
+) -> int:
+    """Migrate the tiles archives to the current format version. The consolidated
+    metadata of the migrated tiles is refreshed, if they have it.
+
+    Args:
+        credentials (str): the gcp credentials
+        tiles (Sequence[Tile]): the tiles
+        constellations (List[str]): the constellations
+        storage_root (str): the archive root path
+        n_jobs (int, optional): number of archives migrated concurrently. Defaults to -1.
+        verbose (int, optional): joblib verbosity. Defaults to 0.
+
+    Returns:
+        int: the number of migrated archives
+    """
+    fs = GCSFileSystem(token=credentials)
+
+    def migrate(tile_id: str, constellation: str) -> bool:
+        try:
+            return migrate_archive_timestamps(
+                fs.get_mapper,
+                storage_root,
+                tile_id,
+                constellation,
+            )
+        except (PathNotFoundError, GroupNotFoundError, ArrayNotFoundError):
+            # the tile has no data of the constellation
+            return False
+
+    def refresh_metadata(tile_id: str):
+        tile_path = f"{storage_root}/{tile_id}"
+        consolidated = ".zmetadata" in fs.get_mapper(tile_path)
+        update_consolidated_metadata(fs.get_mapper, tile_path, consolidated)
+
+    jobs = [
+        delayed(migrate)(tile.id, constellation)
+        for tile in tiles
+        for constellation in constellations
+    ]
+    with tqdm_joblib(tqdm(desc="Migrating archives.", total=len(jobs))):
+        migrated = Parallel(n_jobs=n_jobs, verbose=verbose, prefer="threads")(jobs)
+
+    # the stale consolidated metadata would hide the new order arrays to the readers,
+    # it is refreshed once all the constellations of a tile are migrated
+    n_constellations = len(constellations)
+    migrated_tiles = [
+        tile.id
+        for i, tile in enumerate(tiles)
+        if any(migrated[i * n_constellations : (i + 1) * n_constellations])
+    ]
+    with tqdm_joblib(tqdm(desc="Consolidating metadata.", total=len(migrated_tiles))):
+        Parallel(n_jobs=n_jobs, verbose=verbose, prefer="threads")(
+            [delayed(refresh_metadata)(tile_id) for tile_id in migrated_tiles],
+        )
+
+    logger.info(
+        f"Migrated {sum(migrated)} of {len(jobs)} archives to format version "
+        f"{ARCHIVE_FORMAT_VERSION}.",
+    )
+    return sum(migrated)
@@ -1,8 +1,19 @@
-import datetime
+from collections.abc import MutableMapping
+from typing import Dict
+from typing import Iterator
+from typing import Optional
 
 import numpy as np
 import zarr
 from loguru import logger
+from numcodecs.compat import ensure_bytes
+from satextractor.archive import TIMESTAMPS_DTYPE
+from satextractor.archive import get_compressor
+from satextractor.archive import read_timestamps
+from satextractor.archive import set_format_version
+from satextractor.archive import write_order
+from satextractor.archive import write_timestamps
+from satextractor.models.constellation_info import BAND_INFO
 from zarr.errors import ArrayNotFoundError
 from zarr.errors import ContainsArrayError
 from zarr.errors import ContainsGroupError
@@ -19,6 +30,8 @@ def create_zarr_patch_structure(
     constellation,
     bands,
     overwrite,
+    band_chunk=1,
+    compressor=None,
 ):
     if not sensing_times.size == 0:
         patch_size_pixels = patch_size // min(b["gsd"] for _, b in bands.items())
@@ -30,6 +43,10 @@ def create_zarr_patch_structure(
         )  # make sure the path exists
 
         patch_path = f"{patch_constellation_path}/data"
+        order_path = f"{patch_constellation_path}/order"
+        # each extraction task writes its own rows concurrently, so a chunk never
+        # spans several timestamps
+        chunks = (1, int(band_chunk), int(chunk_size), int(chunk_size))
 
         if overwrite:
             zarr.open_array(
@@ -41,20 +58,15 @@ def create_zarr_patch_structure(
                     int(patch_size_pixels),
                     int(patch_size_pixels),
                 ),
-                chunks=(1, 1, int(chunk_size), int(chunk_size)),
+                chunks=chunks,
                 dtype=np.uint16,
+                compressor=get_compressor(compressor),
             )
 
             # Create timestamps array
             timestamps_path = f"{patch_constellation_path}/timestamps"
-            z_dates = zarr.open_array(
-                fs_mapper(f"{timestamps_path}"),
-                mode="w",
-                shape=(len(sensing_times)),
-                chunks=(len(sensing_times)),
-                dtype="<U27",
-            )
-            z_dates[:] = sensing_times
+            write_timestamps(fs_mapper, timestamps_path, sensing_times)
+            write_order(fs_mapper, order_path, sensing_times)
 
         else:
 
@@ -62,44 +74,30 @@ def create_zarr_patch_structure(
             timestamps_path = f"{patch_constellation_path}/timestamps"
 
             try:
-                existing_timestamps = zarr.open_array(fs_mapper(timestamps_path), "r")[
-                    :
-                ]
-                existing_timestamps = np.array(
-                    [
-                        np.datetime64(datetime.datetime.fromisoformat(el))
-                        for el in existing_timestamps
-                    ],
-                )
-
-                max_existing = max(existing_timestamps)
+                existing_timestamps = read_timestamps(fs_mapper, timestamps_path)
 
-                if max(sensing_times) <= max_existing:
-                    logger.warning(
-                        f"""
-                        Sat-Extractor can only append more recent data or overwrite existing data.
-                        Maximum existing date for {timestamps_path} is {max_existing}
-                        and minimum new_timestep is {min(sensing_times)}.
-                        """,
+                # rows are append only, older sensing times just get new rows too
+                new_timestamps = np.setdiff1d(
+                    np.asarray(sensing_times).astype(TIMESTAMPS_DTYPE),
+                    existing_timestamps,
+                )
+                n_backfilled = int((new_timestamps < existing_timestamps.max()).sum())
+                if n_backfilled:
+                    logger.info(
+                        f"Appending {n_backfilled} timestamps older than the latest "
+                        f"one of {timestamps_path}.",
                     )
 
-                # get union of sensing times
-                timestamps_union = np.union1d(existing_timestamps, sensing_times)
+                timestamps_rows = np.concatenate([existing_timestamps, new_timestamps])
 
             except (PathNotFoundError, ContainsGroupError, ArrayNotFoundError):
-                timestamps_union = sensing_times
+                timestamps_rows = sensing_times
             except Exception as e:
                 raise e
 
-            # write sensing times fresh
-            z_dates = zarr.open_array(
-                fs_mapper(f"{timestamps_path}"),
-                mode="w",
-                shape=(len(timestamps_union)),
-                chunks=(len(timestamps_union)),
-                dtype="<U27",
-            )
-            z_dates[:] = timestamps_union
+            # write sensing times fresh, in the current format version
+            write_timestamps(fs_mapper, timestamps_path, timestamps_rows)
+            write_order(fs_mapper, order_path, timestamps_rows)
 
             # resize any existing array based thereon
 
@@ -110,19 +108,20 @@ def create_zarr_patch_structure(
                     fs_mapper(patch_path),
                     "w-",
                     shape=(
-                        len(timestamps_union),
+                        len(timestamps_rows),
                         len(bands),
                         int(patch_size_pixels),
                         int(patch_size_pixels),
                     ),
-                    chunks=(1, 1, int(chunk_size), int(chunk_size)),
+                    chunks=chunks,
                     dtype=np.uint16,
+                    compressor=get_compressor(compressor),
                 )
             except ContainsArrayError:
                 z_data = zarr.open_array(fs_mapper(patch_path), "r+")
 
                 data_shape = z_data.shape
-                z_data.resize(len(timestamps_union), *data_shape[1:])
+                z_data.resize(len(timestamps_rows), *data_shape[1:])
 
             except Exception as e:
                 raise e
@@ -145,4 +144,95 @@ def create_zarr_patch_structure(
 
                 mask_shape = z_mask.shape
 
-                z_mask.resize(len(timestamps_union), *mask_shape[1:])
+                z_mask.resize(len(timestamps_rows), *mask_shape[1:])
+
+        set_format_version(fs_mapper, patch_constellation_path)
+
+
+class PrefixStore(MutableMapping):
+    """A view of the keys under a path of a dict, to build zarr archives in memory.
+    Keys of the underlying dict are full paths, so it can be uploaded as is.
+
+    Args:
+        objects (Dict[str, bytes]): the dict with all the objects
+        path (str): the path of this store
+    """
+
+    def __init__(self, objects: Dict[str, bytes], path: str):
+        self.objects = objects
+        self.prefix = f"{path.rstrip('/')}/"
+
+    def __getitem__(self, key: str) -> bytes:
+        return self.objects[self.prefix + key]
+
+    def __setitem__(self, key: str, value):
+        self.objects[self.prefix + key] = ensure_bytes(value)
+
+    def __delitem__(self, key: str):
+        del self.objects[self.prefix + key]
+
+    def __iter__(self) -> Iterator[str]:
+        for key in list(self.objects):
+            if key.startswith(self.prefix):
+                yield key[len(self.prefix) :]
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+def build_zarr_tile_structure(
+    storage_path: str,
+    tile_id: str,
+    patch_size: int,
+    chunk_size: int,
+    constellations_sensing_times: Dict[str, np.ndarray],
+    band_chunk: int = 1,
+    compressor: Optional[Dict] = None,
+    consolidated: bool = True,
+) -> Dict[str, bytes]:
+    """Build in memory the archive structure of a new tile, with the same layout as
+    create_zarr_patch_structure, so it can be uploaded in bulk.
+
+    Args:
+        storage_path (str): the archive root path
+        tile_id (str): the tile id
+        patch_size (int): the tile size in meters
+        chunk_size (int): the data chunk size in pixels
+        constellations_sensing_times (Dict[str, np.ndarray]): the sensing times of each
+            constellation
+        band_chunk (int, optional): bands per data chunk. Defaults to 1.
+        compressor (Optional[Dict], optional): the numcodecs compressor config.
+            Defaults to the zarr default.
+        consolidated (bool, optional): add the consolidated metadata of the tile group.
+            Defaults to True.
+
+    Returns:
+        Dict[str, bytes]: the content of every object of the archive, by path
+    """
+    objects: Dict[str, bytes] = {}
+
+    def fs_mapper(path: str) -> PrefixStore:
+        return PrefixStore(objects, path)
+
+    tile_path = f"{storage_path}/{tile_id}"
+    zarr.open_group(fs_mapper(tile_path), "w")
+
+    for constellation, sensing_times in constellations_sensing_times.items():
+        create_zarr_patch_structure(
+            fs_mapper,
+            storage_path,
+            tile_id,
+            patch_size,
+            chunk_size,
+            sensing_times,
+            constellation,
+            BAND_INFO[constellation],
+            True,
+            band_chunk,
+            compressor,
+        )
+
+    if consolidated:
+        zarr.consolidate_metadata(fs_mapper(tile_path))
+
+    return objects
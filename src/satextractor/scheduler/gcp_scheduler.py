@@ -1,9 +1,12 @@
+from typing import Iterator
 from typing import List
+from typing import Sequence
 from typing import Union
 
 import pystac
 from gcsfs import GCSFileSystem
 from satextractor.models import ExtractionTask
+from satextractor.models import MultiBandExtractionTask
 from satextractor.models import Tile
 from satextractor.scheduler import create_tasks_by_splits
 
@@ -13,7 +16,7 @@ def get_scheduler(name, **kwargs):
 
 
 def gcp_schedule(
-    tiles: List[Tile],
+    tiles: Sequence[Tile],
     split_m: int,
     item_collection: Union[str, pystac.ItemCollection],
     constellations: List[str],
@@ -24,8 +27,9 @@ def gcp_schedule(
     overwrite: bool = False,
     storage_path: str = None,
     credentials=None,
+    multiband: bool = False,
     **kwargs,
-) -> List[ExtractionTask]:
+) -> Iterator[Union[ExtractionTask, MultiBandExtractionTask]]:
 
     fs = GCSFileSystem(token=credentials)
     return create_tasks_by_splits(
@@ -40,4 +44,5 @@ def gcp_schedule(
         overwrite,
         storage_path,
         fs.get_mapper,
+        multiband=multiband,
     )
@@ -1,9 +1,15 @@
 import datetime
+import itertools
 from collections import defaultdict
-from itertools import compress
+from typing import Any
 from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import Union
 
 import geopandas as gpd
@@ -13,66 +19,90 @@ import pandas as pd
 import pystac
 import shapely
 import zarr
-from joblib import delayed
-from joblib import Parallel
 from loguru import logger
+from satextractor.archive import TIMESTAMPS_DTYPE
+from satextractor.archive import open_archive
 from satextractor.models import ExtractionTask
+from satextractor.models import MultiBandExtractionTask
 from satextractor.models import Tile
+from satextractor.models import TileSet
 from satextractor.models.constellation_info import BAND_INFO
-from satextractor.tiler import split_region_in_utm_tiles
 from satextractor.utils import get_dates_in_range
-from satextractor.utils import tqdm_joblib
-from sentinelhub import CRS
-from tqdm import tqdm
-from zarr.errors import ArrayNotFoundError
+from zarr.errors import ContainsArrayError
 from zarr.errors import ContainsGroupError
+from zarr.errors import GroupNotFoundError
 from zarr.errors import PathNotFoundError
 
 
-def filter_already_extracted_tasks(fs_mapper, storage_path, extraction_tasks):
+def iter_non_extracted_tasks(
+    fs_mapper: Callable,
+    storage_path: str,
+    extraction_tasks: Iterable[Union[ExtractionTask, MultiBandExtractionTask]],
+) -> Iterator[Union[ExtractionTask, MultiBandExtractionTask]]:
+    """Filter the tasks whose sensing time is already stored in the archive of their
+    first tile. The stored sensing times are read once per tile and constellation, when
+    their first task arrives, so the tasks can be a stream.
 
-    tiles = set([tile.id for task in extraction_tasks for tile in task.tiles])
-    constellations = set([task.constellation for task in extraction_tasks])
-
-    tile_constellation_sensing_times = defaultdict(np.array)
-
-    # Get the existing dates for the task tiles and constellation
-    for tile_id in tiles:
-        for constellation in constellations:
-            try:
-                patch_constellation_path = f"{storage_path}/{tile_id}/{constellation}"
-
-                timestamps_path = f"{patch_constellation_path}/timestamps"
-                existing_timestamps = zarr.open_array(fs_mapper(timestamps_path), "r")[
-                    :
-                ]
-                existing_timestamps = np.array(
-                    [
-                        np.datetime64(datetime.datetime.fromisoformat(el))
-                        for el in existing_timestamps
-                    ],
-                )
+    Args:
+        fs_mapper (Callable): the mapper function of the file system
+        storage_path (str): the archive root path
+        extraction_tasks (Iterable[Union[ExtractionTask, MultiBandExtractionTask]]): the
+            tasks
 
-                tile_constellation_sensing_times[
-                    patch_constellation_path
-                ] = existing_timestamps
-            except (PathNotFoundError, ContainsGroupError, ArrayNotFoundError):
-                continue
+    Yields:
+        Iterator[Union[ExtractionTask, MultiBandExtractionTask]]: the tasks not extracted yet
+    """
+    archives: Dict[str, Optional[zarr.hierarchy.Group]] = {}
+    tile_constellation_sensing_times: Dict[str, Optional[np.ndarray]] = {}
+    n_filtered = 0
 
-    non_extracted = []
     for task in extraction_tasks:
         first_tile = task.tiles[0]  # we only need one for this check
         patch_constellation_path = (
             f"{storage_path}/{first_tile.id}/{task.constellation}"
         )
-        dates = tile_constellation_sensing_times.get(patch_constellation_path)
-        if dates is None or task.sensing_time > dates.max():
-            non_extracted.append(task)
-    return non_extracted
+
+        if patch_constellation_path not in tile_constellation_sensing_times:
+            if first_tile.id not in archives:
+                try:
+                    archives[first_tile.id] = open_archive(
+                        fs_mapper,
+                        f"{storage_path}/{first_tile.id}",
+                    )
+                except (PathNotFoundError, GroupNotFoundError, ContainsArrayError):
+                    archives[first_tile.id] = None
+
+            dates = None
+            archive = archives[first_tile.id]
+            if archive is not None:
+                try:
+                    existing_timestamps = archive[f"{task.constellation}/timestamps"][:]
+                    # rows are append only, sorted to look the sensing times up
+                    dates = np.sort(existing_timestamps.astype(TIMESTAMPS_DTYPE))
+                except (KeyError, ContainsGroupError):
+                    pass
+            tile_constellation_sensing_times[patch_constellation_path] = dates
+
+        dates = tile_constellation_sensing_times[patch_constellation_path]
+        if dates is None:
+            yield task
+            continue
+
+        # sensing times older than the stored ones are backfilled, not extracted yet
+        sensing_time = np.datetime64(task.sensing_time, "ns")
+        idx = np.searchsorted(dates, sensing_time)
+        if idx == len(dates) or dates[idx] != sensing_time:
+            yield task
+        else:
+            n_filtered += 1
+
+    logger.info(
+        f"{n_filtered} tasks were filtered because they already exists in storage",
+    )
 
 
 def create_tasks_by_splits(
-    tiles: List[Tile],
+    tiles: Sequence[Tile],
     split_m: int,
     item_collection: Union[str, pystac.ItemCollection],
     constellations: List[str],
@@ -84,222 +114,402 @@ def create_tasks_by_splits(
     storage_path: str = None,
     fs_mapper: Optional[Callable] = None,
     collection_chunks: int = 100,
-) -> List[ExtractionTask]:
+    multiband: bool = False,
+) -> Iterator[Union[ExtractionTask, MultiBandExtractionTask]]:
     """Group tiles in splits of given split_m size. It creates a task per split
     with the tiles contained by that split and the intersection with the
     stac items.
     An extraction task is created for each band listed as param (eo:bands extension otherwise)
-    and for each revisit in the given date range
+    and for each revisit in the given date range. If multiband is set, a single
+    task extracts all the bands of a revisit.
+    The tasks are created as they are consumed, so they are never all in memory.
 
 
     Args:
-        tiles (List[Tile]): The tiles to separate in zones
+        tiles (Sequence[Tile]): The tiles to separate in zones
         split_m (int): the split square size in m,
         item_collection (Union[str, ItemCollection]): Path to geojson or pystac ItemCollectIon object
         bands (List[str]): the bands to extract
         interval (int): the day intervale between revisits
-        n_jobs (int): n_jobs used by joblib
-        verbos (int): verbose for joblib
+        n_jobs (int): unused, kept for compatibility
+        verbose (int): unused, kept for compatibility
+        multiband (bool): create MultiBandExtractionTasks instead of a task per band
 
 
     Returns:
-        List[ExtractionTask]: List of extraction tasks ready to deploy
+        Iterator[Union[ExtractionTask, MultiBandExtractionTask]]: the extraction tasks ready to deploy
     """
 
+    tasks = iter_tasks_by_splits(
+        tiles,
+        split_m,
+        item_collection,
+        constellations,
+        bands,
+        interval,
+        collection_chunks,
+        multiband,
+    )
+
     if not overwrite:
-        if not fs_mapper:
-            raise Exception("'fs_mapper' can't be None if 'overwrite' is set to False")
+        if not fs_mapper or not storage_path:
+            raise Exception(
+                "'fs_mapper' and 'storage_path' can't be None if 'overwrite' is set to False",
+            )
 
-    logger.info("Loading items geojson...")
-    counter = 0
-    items = []
-    tasks: List[ExtractionTask] = []
+        logger.info(
+            "Filtering already extracted tasks. Checking existing dates in storage...",
+        )
+        tasks = iter_non_extracted_tasks(fs_mapper, storage_path, tasks)
+
+    return tasks
+
+
+def iter_items(
+    item_collection: Union[str, pystac.ItemCollection, dict],
+) -> Iterator[dict]:
+    """Iterate over the items of a collection as dicts. Items of a geojson file are
+    parsed incrementally, so the collection is never fully loaded in memory.
 
+    Args:
+        item_collection (Union[str, pystac.ItemCollection, dict]): path to geojson,
+            pystac ItemCollection or feature collection dict
+
+    Yields:
+        Iterator[dict]: the items
+    """
     if isinstance(item_collection, str):
-        json_file = open(item_collection, "rb")
-        all_items = ijson.items(json_file, "features.item")
+        with open(item_collection, "rb") as json_file:
+            yield from ijson.items(json_file, "features.item")
+    elif isinstance(item_collection, pystac.ItemCollection):
+        for item in item_collection:
+            yield item.to_dict()
     else:
-        all_items = item_collection["features"]
+        yield from item_collection["features"]
 
-    for item in all_items:
-        if counter < collection_chunks:
-            items.append(item)
-            counter += 1
-        else:
-            counter = 0
 
-            stac_items = pystac.ItemCollection(
-                items=[pystac.Item.from_dict(it) for it in items],
-            )
-            gdf = gpd.GeoDataFrame.from_features(
-                {"type": "FeatureCollection", "features": items},
-            )
-            items = []
+def iter_chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    """Group the items of an iterable in lists of chunk_size, the last one with the
+    remaining items.
 
-            gdf.datetime = pd.to_datetime(gdf.datetime).dt.tz_localize(None)
+    Args:
+        items (Iterable[Any]): the items
+        chunk_size (int): the max number of items per chunk
 
-            tiles_gdf = cluster_tiles_in_utm(tiles, split_m)
+    Yields:
+        Iterator[List[Any]]: the chunks
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
-            logger.info(
-                "Creating extraction tasks for each constellations, date, and band ...",
-            )
 
-            task_tracker = 0
+def iter_tasks_by_splits(
+    tiles: Sequence[Tile],
+    split_m: int,
+    item_collection: Union[str, pystac.ItemCollection, dict],
+    constellations: List[str],
+    bands: List[str] = None,
+    interval: int = 1,
+    collection_chunks: int = 100,
+    multiband: bool = False,
+) -> Iterator[Union[ExtractionTask, MultiBandExtractionTask]]:
+    """Create the extraction tasks of create_tasks_by_splits as a stream. The tiles are
+    clustered once, and the items are consumed in chunks of collection_chunks, so the
+    memory doesn't grow with the size of the collection.
 
-            for constellation in constellations:
+    Args:
+        tiles (Sequence[Tile]): The tiles to separate in zones
+        split_m (int): the split square size in m,
+        item_collection (Union[str, pystac.ItemCollection, dict]): path to geojson,
+            pystac ItemCollection or feature collection dict
+        constellations (List[str]): the constellations
+        bands (List[str], optional): the bands to extract. Defaults to all the bands.
+        interval (int, optional): the day interval between revisits. Defaults to 1.
+        collection_chunks (int, optional): items per chunk. Defaults to 100.
+        multiband (bool, optional): create MultiBandExtractionTasks instead of a task per
+            band. Defaults to False.
+
+    Yields:
+        Iterator[Union[ExtractionTask, MultiBandExtractionTask]]: the extraction tasks
+    """
+    logger.info("Clustering the tiles...")
+    tiles_gdf = cluster_tiles_in_utm(tiles, split_m)
+    clusters_gdf = get_clusters_gdf(tiles_gdf)
+
+    # task ids are unique across chunks
+    task_ids = itertools.count()
+
+    logger.info("Creating extraction tasks for each chunk of items...")
+    for items in iter_chunks(iter_items(item_collection), collection_chunks):
+        yield from get_items_tasks(
+            items,
+            tiles,
+            tiles_gdf,
+            clusters_gdf,
+            constellations,
+            bands,
+            interval,
+            multiband,
+            task_ids,
+        )
 
-                # Get all the date ranges for the given interval
-                dates = get_dates_in_range(
-                    gdf.loc[gdf.constellation == constellation, "datetime"]
-                    .min()
-                    .to_pydatetime(),
-                    gdf.loc[gdf.constellation == constellation, "datetime"]
-                    .max()
-                    .to_pydatetime(),
-                    interval,
-                )
 
-                if bands is not None:
-                    run_bands = [
-                        b["band"].name
-                        for kk, b in BAND_INFO[constellation].items()
-                        if b["band"].name in bands
-                    ]
-                else:
-                    run_bands = [
-                        b["band"].name for kk, b in BAND_INFO[constellation].items()
-                    ]
+def get_items_tasks(
+    items: List[dict],
+    tiles: Sequence[Tile],
+    tiles_gdf: gpd.GeoDataFrame,
+    clusters_gdf: gpd.GeoDataFrame,
+    constellations: List[str],
+    bands: Optional[List[str]],
+    interval: int,
+    multiband: bool,
+    task_ids: Iterator[int],
+) -> Iterator[Union[ExtractionTask, MultiBandExtractionTask]]:
+    """Create the extraction tasks of a chunk of items, for each constellation, date
+    range, tiles cluster and band.
 
-                logger.info(
-                    f"Getting cluster item indexes for {constellation} in parallel...",
-                )
-                with tqdm_joblib(
-                    tqdm(desc="Extraction Tasks creation.", total=len(dates)),
-                ):
-                    cluster_items = Parallel(n_jobs=n_jobs, verbose=verbose)(
-                        delayed(get_cluster_items_indexes)(
-                            gdf[
-                                (gdf.datetime >= start)
-                                & (gdf.datetime <= end)
-                                & (gdf.constellation == constellation)
-                            ],
-                            tiles_gdf,
-                        )
-                        for start, end in dates
-                    )
+    Args:
+        items (List[dict]): the items
+        tiles (Sequence[Tile]): the tiles
+        tiles_gdf (gpd.GeoDataFrame): the tiles gdf with a cluster_id col
+        clusters_gdf (gpd.GeoDataFrame): the clusters gdf with a cluster_id col
+        constellations (List[str]): the constellations
+        bands (List[str]): the bands to extract, None for all the bands
+        interval (int): the day interval between revisits
+        multiband (bool): create MultiBandExtractionTasks instead of a task per band
+        task_ids (Iterator[int]): the task ids counter
+
+    Yields:
+        Iterator[Union[ExtractionTask, MultiBandExtractionTask]]: the extraction tasks
+    """
+    stac_items = pystac.ItemCollection(
+        items=[pystac.Item.from_dict(it) for it in items],
+    )
+    gdf = gpd.GeoDataFrame.from_features(
+        {"type": "FeatureCollection", "features": items},
+    )
+    gdf.datetime = pd.to_datetime(gdf.datetime).dt.tz_localize(None)
 
-                for i, date_cluster_item in enumerate(cluster_items):
-                    for k, v in date_cluster_item.items():
-                        if v:
-                            c_tiles = tiles_gdf[tiles_gdf["cluster_id"] == k]
-                            c_items_geom = gdf.iloc[v].unary_union
-                            t_indexes = c_tiles[
-                                c_tiles.geometry.apply(c_items_geom.contains)
-                            ].index
-                            if not t_indexes.empty:
-                                c_items = pystac.ItemCollection(
-                                    [stac_items.items[item_index] for item_index in v],
-                                )
-                                region_tiles = [tiles[t_index] for t_index in t_indexes]
-                                sensing_time = dates[i][0]
-
-                                for b in run_bands:
-                                    tasks.append(
-                                        ExtractionTask(
-                                            task_id=str(task_tracker),
-                                            tiles=region_tiles,
-                                            item_collection=c_items,
-                                            band=b,
-                                            constellation=constellation,
-                                            sensing_time=sensing_time,
-                                        ),
-                                    )
-                                    task_tracker += 1
-
-    try:
-        json_file.close()
-    except Exception:
-        pass
-
-    logger.info(f"There are a total of {len(tasks)} tasks")
+    items_clusters = get_items_clusters(gdf, clusters_gdf)
 
-    if not overwrite:
-        logger.info(
-            "Filtering already extracted tasks. Checking existing dates in storage...",
-        )
+    for constellation in constellations:
 
-        filtered_extraction_tasks = filter_already_extracted_tasks(
-            fs_mapper,
-            storage_path,
-            tasks,
+        c_gdf = gdf[gdf.constellation == constellation]
+        if c_gdf.empty:
+            continue
+
+        # Get all the date ranges for the given interval
+        dates = get_dates_in_range(
+            c_gdf.datetime.min().to_pydatetime(),
+            c_gdf.datetime.max().to_pydatetime(),
+            interval,
         )
 
-        logger.info(
-            f"{len(tasks) - len(filtered_extraction_tasks)} tasks were filtered because they already exists in storage",
+        if bands is not None:
+            run_bands = [
+                b["band"].name
+                for kk, b in BAND_INFO[constellation].items()
+                if b["band"].name in bands
+            ]
+        else:
+            run_bands = [b["band"].name for kk, b in BAND_INFO[constellation].items()]
+
+        dates_items = get_dates_items_indexes(
+            c_gdf.datetime.values,
+            c_gdf.index.values,
+            dates,
         )
-        tasks = filtered_extraction_tasks
 
-    return tasks
+        for i, date_items in enumerate(dates_items):
+            date_cluster_items = get_cluster_items_indexes(date_items, items_clusters)
+            for k, v in date_cluster_items.items():
+                c_tiles = tiles_gdf[tiles_gdf["cluster_id"] == k]
+                c_items_geom = gdf.iloc[v].unary_union
+                t_indexes = c_tiles[c_tiles.geometry.apply(c_items_geom.contains)].index
+                if t_indexes.empty:
+                    continue
+
+                # the items are shared by the tasks, so they are pickled once
+                c_items = pystac.ItemCollection(
+                    [stac_items.items[item_index] for item_index in v],
+                    clone_items=False,
+                )
+                region_tiles = [tiles[t_index] for t_index in t_indexes]
+                sensing_time = dates[i][0]
+
+                if multiband:
+                    yield MultiBandExtractionTask(
+                        task_id=str(next(task_ids)),
+                        tiles=region_tiles,
+                        item_collection=c_items,
+                        bands=run_bands,
+                        constellation=constellation,
+                        sensing_time=sensing_time,
+                    )
+                else:
+                    for b in run_bands:
+                        yield ExtractionTask(
+                            task_id=str(next(task_ids)),
+                            tiles=region_tiles,
+                            item_collection=c_items,
+                            band=b,
+                            constellation=constellation,
+                            sensing_time=sensing_time,
+                        )
+
+
+def get_tiles_cluster_ids(
+    tiles: Sequence[Tile],
+    split_m: int,
+) -> np.ndarray:
+    """Get the cluster of each tile, the UTM square of size split_m that contains it.
+    The squares are aligned to multiples of split_m in the UTM zone of the tiles, as
+    the ones of split_region_in_utm_tiles, so the cluster of a tile follows from its
+    coordinates.
+
+    Args:
+        tiles (Sequence[Tile]): the tiles
+        split_m (int): the split square size in m
+
+    Returns:
+        np.ndarray: the cluster id of each tile
+    """
+    tiles = TileSet.from_tiles(tiles)
+    if not len(tiles):
+        return np.zeros(0, dtype=int)
 
+    keys = np.stack(
+        [
+            tiles.epsg.astype(int),
+            np.floor(tiles.min_x / split_m),
+            np.floor(tiles.min_y / split_m),
+        ],
+        axis=1,
+    ).astype(float)
+    _, cluster_ids = np.unique(keys, axis=0, return_inverse=True)
 
-def cluster_tiles_in_utm(tiles: List[Tile], split_m: int) -> gpd.GeoDataFrame:
+    return cluster_ids.reshape(-1)
+
+
+def cluster_tiles_in_utm(
+    tiles: Sequence[Tile],
+    split_m: int,
+) -> gpd.GeoDataFrame:
     """Group tiles in splits of given split_m size.
 
 
     Args:
-        tiles (List[Tile]): The tiles to separate in zones
+        tiles (Sequence[Tile]): The tiles to separate in zones
         split_m (int): the split square size in m,
 
     Returns:
         gpd.GeoDataFrame: The resulting geopandas df of the tiles and their clusters
     """
-
-    tiles_geom = gpd.GeoSeries([shapely.geometry.box(*t.bbox_wgs84) for t in tiles])
-
-    # Split the tiles regions in UTM squares of size split_m
-    logger.info("Creating multipolygon of the tiles geometries...")
-    tiles_geom_multi = shapely.geometry.MultiPolygon(tiles_geom.values)
-    splits = split_region_in_utm_tiles(
-        tiles_geom_multi,
-        crs=CRS.WGS84,
-        bbox_size=split_m,
+    tiles = TileSet.from_tiles(tiles)
+    tiles_geom = gpd.GeoSeries(
+        [shapely.geometry.box(*bounds) for bounds in tiles.bbox_wgs84],
     )
 
     tiles_gdf = gpd.GeoDataFrame({"geometry": tiles_geom})
-    for cluster_i, s in enumerate(splits):
-        contained_tile_indexes = [i for i in range(len(tiles)) if s.contains(tiles[i])]
-        tiles_gdf.loc[contained_tile_indexes, "cluster_id"] = cluster_i
+    tiles_gdf["cluster_id"] = get_tiles_cluster_ids(tiles, split_m)
 
     return tiles_gdf
 
 
-def get_cluster_items_indexes(
+def get_clusters_gdf(tiles_gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Get the geometry of each cluster, the multipolygon of its tiles.
+
+    Args:
+        tiles_gdf (gpd.GeoDataFrame): the tiles gdf with a cluster_id col
+
+    Returns:
+        gpd.GeoDataFrame: the clusters gdf with a cluster_id col
+    """
+    cluster_ids = []
+    geometries = []
+    for cluster_id, cluster_tiles in tiles_gdf.groupby("cluster_id"):
+        cluster_ids.append(cluster_id)
+        geometries.append(shapely.geometry.MultiPolygon(list(cluster_tiles.geometry)))
+
+    return gpd.GeoDataFrame(
+        {"cluster_id": cluster_ids},
+        geometry=geometries,
+        crs=tiles_gdf.crs,
+    )
+
+
+def get_items_clusters(
     items_gdf: gpd.GeoDataFrame,
-    tile_clusters: gpd.GeoDataFrame,
-) -> dict:
-    """Given an items geodataframe and a tile clusters geodataframe,
-    return the items indexes that belong to each cluster.
+    clusters_gdf: gpd.GeoDataFrame,
+) -> Dict[int, List[int]]:
+    """Get the clusters intersected by each item, with a single spatial join.
 
     Args:
         items_gdf (gpd.GeoDataFrame): the items gdf
-        tile_clusters (gpd.GeoDataFrame): the tile cluster gdf that should contain
-                                          a cluster_id col
+        clusters_gdf (gpd.GeoDataFrame): the clusters gdf with a cluster_id col
 
     Returns:
-        dict: a dictionary where keys are clusters and values item indexes
+        Dict[int, List[int]]: the clusters of each item index, items without
+            clusters are left out
     """
-    cluster_item_indexes = {}
-    clusters = tile_clusters.cluster_id.unique()
-    for c in clusters:
-        s_geom_bounds = shapely.geometry.MultiPolygon(
-            tile_clusters[tile_clusters.cluster_id == c].geometry.values,
-        )
-        prep_geom = shapely.ops.prep(s_geom_bounds)
-        s = items_gdf.geometry.apply(prep_geom.intersects)
+    joined = gpd.sjoin(
+        items_gdf[["geometry"]],
+        clusters_gdf,
+        how="inner",
+        predicate="intersects",
+    )
+    return joined.groupby(level=0)["cluster_id"].apply(list).to_dict()
+
+
+def get_dates_items_indexes(
+    datetimes: np.ndarray,
+    indexes: np.ndarray,
+    dates: List[Tuple[datetime.datetime, datetime.datetime]],
+) -> List[np.ndarray]:
+    """Get the items indexes of each date range, searching the range bounds in the
+    sorted datetimes instead of scanning all the items for every range.
+
+    Args:
+        datetimes (np.ndarray): the items datetimes
+        indexes (np.ndarray): the items indexes
+        dates (List[Tuple[datetime.datetime, datetime.datetime]]): the date ranges,
+            both bounds included
 
-        # Select the tiles for that cluster
-        region_items = list(compress(items_gdf.index.values.tolist(), s))
+    Returns:
+        List[np.ndarray]: the sorted items indexes of each date range
+    """
+    order = np.argsort(datetimes, kind="stable")
+    sorted_datetimes = datetimes[order]
+    starts = np.array([start for start, _ in dates], dtype=sorted_datetimes.dtype)
+    ends = np.array([end for _, end in dates], dtype=sorted_datetimes.dtype)
+
+    lows = np.searchsorted(sorted_datetimes, starts, side="left")
+    highs = np.searchsorted(sorted_datetimes, ends, side="right")
+
+    return [np.sort(indexes[order[low:high]]) for low, high in zip(lows, highs)]
 
-        cluster_item_indexes[c] = region_items
 
-    return cluster_item_indexes
+def get_cluster_items_indexes(
+    items_indexes: np.ndarray,
+    items_clusters: Dict[int, List[int]],
+) -> Dict[int, List[int]]:
+    """Given the items indexes of a date range and the clusters of each item,
+    return the items indexes that belong to each cluster.
+
+    Args:
+        items_indexes (np.ndarray): the sorted items indexes
+        items_clusters (Dict[int, List[int]]): the clusters of each item index
+
+    Returns:
+        dict: a dictionary where keys are clusters and values item indexes
+    """
+    cluster_item_indexes: Dict[int, List[int]] = defaultdict(list)
+    for item_index in items_indexes.tolist():
+        for cluster_id in items_clusters.get(item_index, []):
+            cluster_item_indexes[cluster_id].append(item_index)
+
+    return dict(cluster_item_indexes)
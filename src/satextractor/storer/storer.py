@@ -1,54 +1,260 @@
 import datetime
+import os
+from concurrent.futures import Executor
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
+from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Union
 
 import numpy as np
 import zarr
+from satextractor.archive import get_timestamp_index
+from satextractor.archive import read_order
+from satextractor.archive import read_timestamps
 from satextractor.models import ExtractionTask
+from satextractor.models import MultiBandExtractionTask
+from satextractor.models import Tile
+
+
+def store_tile_patch(
+    fs_mapper: Any,
+    storage_path: str,
+    tile: Tile,
+    patch: np.ndarray,
+    constellation: str,
+    sensing_time: datetime.datetime,
+    band_idx: Union[int, List[int]],
+    archive_resolution: int,
+    encoder: Optional[Executor] = None,
+):
+    """Store the patch of a tile in its archive, skipping the nodata chunks, so only
+    the patches with data have chunks in the archive.
+    Whole chunks are encoded by the encoder, if given, and uploaded together by the
+    calling thread, so the encoding of a patch overlaps the uploads of others.
+
+    Args:
+        fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
+        storage_path (str): The path where to store the patches
+        tile (Tile): the tile
+        patch (np.ndarray): the patch, (height, width) or (bands, height, width)
+        constellation (str): the patch constellation
+        sensing_time (datetime.datetime): the patch sensing time
+        band_idx (Union[int, List[int]]): the archive index of the patch band(s)
+        archive_resolution (int): the archive resolution
+        encoder (Optional[Executor], optional): the executor encoding the chunks.
+            Defaults to None, to encode them in the calling thread.
+    """
+    if not patch.any():
+        # nothing to store, the patch has no chunks
+        return
+
+    data_path = f"{storage_path}/{tile.id}/{constellation}/data"
+    timestamps_path = f"{storage_path}/{tile.id}/{constellation}/timestamps"
+    order_path = f"{storage_path}/{tile.id}/{constellation}/order"
+
+    timestamps = read_timestamps(fs_mapper, timestamps_path)
+    order = read_order(fs_mapper, order_path)
+    timestamp_idx = get_timestamp_index(timestamps, sensing_time, order)
+
+    size = (
+        tile.bbox_size[0] // archive_resolution,
+        tile.bbox_size[1] // archive_resolution,
+    )
+    arr = zarr.open_array(
+        store=fs_mapper(data_path),
+        dtype=np.uint16,
+    )
+
+    if patch.shape[-2:] != size:
+        pad_x = int(size[0] - patch.shape[-2])
+        pad_y = int(size[1] - patch.shape[-1])
+        patch = np.pad(
+            patch,
+            [(0, 0)] * (patch.ndim - 2) + [(0, pad_x), (0, pad_y)],
+        )
+    assert patch.shape[-2:] == size
+
+    bands_idx = np.atleast_1d(band_idx).tolist()
+    patches = patch.reshape(len(bands_idx), *size)
+    if encoder is None:
+        chunks = encode_patch_chunks(arr, timestamp_idx, bands_idx, patches)
+    else:
+        chunks = encoder.submit(
+            encode_patch_chunks,
+            arr,
+            timestamp_idx,
+            bands_idx,
+            patches,
+        ).result()
+
+    if chunks is None:
+        # the patches cover chunks partially, zarr has to merge them with the stored ones
+        write_patch_chunks(arr, timestamp_idx, bands_idx, patches)
+    elif hasattr(arr.chunk_store, "setitems"):
+        # fsspec mappers upload all the chunks concurrently
+        arr.chunk_store.setitems(chunks)
+    else:
+        arr.chunk_store.update(chunks)
+
+
+def encode_patch_chunks(
+    arr: zarr.Array,
+    timestamp_idx: int,
+    bands_idx: List[int],
+    patches: np.ndarray,
+    nodata: int = 0,
+) -> Optional[Dict[str, bytes]]:
+    """Encode the chunks of the patches of a timestamp that are not all nodata, to
+    upload them to the array store directly. Edge chunks are padded with the fill
+    value, as zarr does, so existing chunks never have to be read.
+
+    Args:
+        arr (zarr.Array): the (timestamps, bands, height, width) data array
+        timestamp_idx (int): the timestamp index
+        bands_idx (List[int]): the bands indices of the patches
+        patches (np.ndarray): the (bands, height, width) patches
+        nodata (int, optional): the nodata value. Defaults to 0.
+
+    Returns:
+        Optional[Dict[str, bytes]]: the encoded chunks by store key, None if the patches
+            don't cover whole chunks, e.g. chunks spanning several timestamps
+    """
+    time_chunk, band_chunk, chunk_y, chunk_x = arr.chunks
+    if time_chunk != 1:
+        return None
+
+    bands_chunk_idx = np.array(bands_idx) // band_chunk
+
+    chunks = {}
+    for band_chunk_idx in np.unique(bands_chunk_idx):
+        sel = np.flatnonzero(bands_chunk_idx == band_chunk_idx)
+        # the bands of the chunk must all be in the patches, in the chunk order
+        sel = sel[np.argsort([bands_idx[i] for i in sel])]
+        chunk_start = band_chunk_idx * band_chunk
+        chunk_bands = range(chunk_start, min(chunk_start + band_chunk, arr.shape[1]))
+        if [bands_idx[i] for i in sel] != list(chunk_bands):
+            return None
+
+        for y in range(0, patches.shape[-2], chunk_y):
+            for x in range(0, patches.shape[-1], chunk_x):
+                block = patches[sel, y : y + chunk_y, x : x + chunk_x]
+                if (block == nodata).all():
+                    continue
+                chunk = np.full(
+                    (1, band_chunk, chunk_y, chunk_x),
+                    arr.fill_value,
+                    dtype=arr.dtype,
+                )
+                chunk[0, : len(sel), : block.shape[1], : block.shape[2]] = block
+                # private zarr methods, checked against zarr 2.10.3 as pinned in
+                # setup.py, so the keys and the encoding always match zarr's own
+                key = arr._chunk_key(
+                    (timestamp_idx, band_chunk_idx, y // chunk_y, x // chunk_x),
+                )
+                chunks[key] = arr._encode_chunk(chunk)
+
+    return chunks
+
+
+def write_patch_chunks(
+    arr: zarr.Array,
+    timestamp_idx: int,
+    bands_idx: List[int],
+    patches: np.ndarray,
+    nodata: int = 0,
+) -> int:
+    """Write the patches of a timestamp chunk by chunk, skipping the chunks that are
+    all nodata. Missing chunks read as the array fill value, so skipped chunks are
+    neither uploaded nor stored.
+
+    Args:
+        arr (zarr.Array): the (timestamps, bands, height, width) data array
+        timestamp_idx (int): the timestamp index
+        bands_idx (List[int]): the bands indices of the patches
+        patches (np.ndarray): the (bands, height, width) patches
+        nodata (int, optional): the nodata value. Defaults to 0.
+
+    Returns:
+        int: the number of chunks written
+    """
+    _, band_chunk, chunk_y, chunk_x = arr.chunks
+    bands_chunk_idx = np.array(bands_idx) // band_chunk
+
+    written = 0
+    for band_chunk_idx in np.unique(bands_chunk_idx):
+        sel = np.flatnonzero(bands_chunk_idx == band_chunk_idx)
+        sel_bands = [bands_idx[i] for i in sel]
+        for y in range(0, patches.shape[-2], chunk_y):
+            for x in range(0, patches.shape[-1], chunk_x):
+                block = patches[sel, y : y + chunk_y, x : x + chunk_x]
+                if (block == nodata).all():
+                    continue
+                arr.oindex[
+                    [timestamp_idx],
+                    sel_bands,
+                    slice(y, y + chunk_y),
+                    slice(x, x + chunk_x),
+                ] = block[np.newaxis]
+                written += 1
+
+    return written
 
 
 def store_patches(
     fs_mapper: Any,
     storage_path: str,
     patches: List[np.ndarray],
-    task: ExtractionTask,
+    task: Union[ExtractionTask, MultiBandExtractionTask],
     bands: List[str],
     archive_resolution: int,
+    max_workers: int = 8,
+    encode_workers: Optional[int] = None,
 ):
     """Store a list of patches in storage path.
     Assumes the target structure file is already created.
+    Each tile has its own archive, so the patches are stored concurrently. The chunks
+    are encoded in a separate pool sized to the cpus, the codecs release the GIL, so
+    the encoding runs in parallel and overlaps the uploads.
 
     Args:
         fs_mapper (Any): a file system mapper to map the path, e.x: gcsfs.get_mapper
         storage_path (str): The path where to store the patches
-        patches (List[np.ndarray]): The patches as numpy arrays
-        task (ExtractionTask): The extraction task containing the tiles
+        patches (List[np.ndarray]): The patches as numpy arrays, (bands, height, width)
+            arrays for a MultiBandExtractionTask
+        task (Union[ExtractionTask, MultiBandExtractionTask]): The extraction task containing the tiles
         bands (List[str]): the bands
+        archive_resolution (int): the archive resolution
+        max_workers (int, optional): max number of patches stored concurrently. Defaults to 8.
+        encode_workers (Optional[int], optional): number of threads encoding the chunks.
+            Defaults to the number of cpus.
     """
-    tiles = task.tiles
-    for i, tile in enumerate(tiles):
-
-        data_path = f"{storage_path}/{tile.id}/{task.constellation}/data"
-        timestamps_path = f"{storage_path}/{tile.id}/{task.constellation}/timestamps"
-
-        timestamps = zarr.open(fs_mapper(timestamps_path))[:]
-        timestamps = [datetime.datetime.fromisoformat(el) for el in timestamps]
+    band_idx: Union[int, List[int]]
+    if isinstance(task, MultiBandExtractionTask):
+        band_idx = [bands.index(band.upper()) for band in task.bands]
+    else:
+        band_idx = bands.index(task.band.upper())
 
-        size = (
-            tile.bbox_size[0] // archive_resolution,
-            tile.bbox_size[1] // archive_resolution,
-        )
-        arr = zarr.open_array(
-            store=fs_mapper(data_path),
-            dtype=np.uint16,
+    def store(tile_patch):
+        tile, patch = tile_patch
+        store_tile_patch(
+            fs_mapper,
+            storage_path,
+            tile,
+            patch,
+            task.constellation,
+            task.sensing_time,
+            band_idx,
+            archive_resolution,
+            encoder,
         )
-        band_idx = bands.index(task.band.upper())
-        timestamp_idx = timestamps.index(task.sensing_time)
-        patch = patches[i]
-
-        if patch.shape != size:
-            pad_x = int(size[0] - patch.shape[0])
-            pad_y = int(size[1] - patch.shape[1])
-            patch = np.pad(patch, [(0, pad_x), (0, pad_y)])
-        assert patch.shape == size
-        arr[timestamp_idx, band_idx, :, :] = patch
+
+    tile_patches = list(zip(task.tiles, patches))
+    n_workers = max(min(max_workers, len(tile_patches)), 1)
+    n_encoders = encode_workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=n_encoders) as encoder, ThreadPoolExecutor(
+        max_workers=n_workers,
+    ) as executor:
+        # consume the results so the first error is raised
+        list(executor.map(store, tile_patches))